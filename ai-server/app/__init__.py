@@ -1,10 +1,41 @@
+import asyncio
 from fastapi import FastAPI
+from app.config import Config
+from .logger import setup_logging, RequestIdMiddleware
+
+# Cấu hình logging trước khi import các module khác để không mất log lúc khởi tạo
+setup_logging()
+
 from .routes import router
+from .topic_index import topic_index
+from .lexical_index import lexical_index
 
 # Khởi tạo ứng dụng FastAPI
 app = FastAPI()
+app.add_middleware(RequestIdMiddleware)
 
 # Đăng ký các route
 app.include_router(router)
 
+# Profiling chỉ được import và đăng ký khi bật, không tốn chi phí khi tắt
+if Config.PROFILING_ENABLED:
+    from .profiling import profiling_router, loop_lag_monitor
+    app.include_router(profiling_router)
+
+    @app.on_event("startup")
+    async def start_loop_lag_monitor():
+        loop_lag_monitor.start()
+
+    @app.on_event("shutdown")
+    async def stop_loop_lag_monitor():
+        loop_lag_monitor.stop()
+
+@app.on_event("startup")
+async def build_indexes():
+    # Build các index ở background để không làm chậm quá trình khởi động
+    if Config.TOPIC_INDEX_ENABLED:
+        asyncio.create_task(topic_index.build())
+    if Config.LEXICAL_INDEX_ENABLED:
+        asyncio.create_task(lexical_index.build())
+
 # Nếu bạn có các middleware hoặc các phần mở rộng khác, bạn có thể cấu hình ở đây
\ No newline at end of file
@@ -0,0 +1,161 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from app.config import Config
+from .deadline import remaining_time
+from .metrics import ADMISSION_IN_FLIGHT, MEDIA_BYTES_IN_FLIGHT, QUEUE_DEPTH, SHED_REQUESTS
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+class Overloaded(Exception):
+    """Server đang quá tải, client nên thử lại sau retry_after giây"""
+
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(f"Server overloaded ({reason})")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class MediaBudget:
+    """Tổng số byte media đang được giữ trong bộ nhớ bởi các request đang xử lý"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+
+    def has_room(self, estimated_bytes):
+        return self.in_flight + estimated_bytes <= self.max_bytes
+
+    def try_reserve(self, size):
+        """Giữ chỗ trước cho media sắp tải; không đủ chỗ thì trả về False"""
+        if not self.has_room(size):
+            return False
+        self.in_flight += size
+        return True
+
+    def add(self, size):
+        self.in_flight += size
+
+    def release(self, size):
+        self.in_flight = max(0, self.in_flight - size)
+
+media_budget = MediaBudget(Config.ADMISSION_MAX_MEDIA_BYTES)
+
+# Budget media của request hiện tại: [byte giữ chỗ còn lại, byte đã tải về], trả lại khi request kết thúc
+_request_media_bytes = ContextVar("request_media_bytes", default=None)
+
+def track_media_bytes(size):
+    """Ghi nhận media vừa tải về cho request hiện tại: trừ vào phần đã giữ chỗ, vượt thì tính thêm"""
+    counter = _request_media_bytes.get()
+    if counter is None:
+        return
+    from_reservation = min(size, counter[0])
+    counter[0] -= from_reservation
+    counter[1] += size
+    media_budget.add(size - from_reservation)
+
+class AdmissionController:
+    """Giới hạn số request xử lý đồng thời của một endpoint, kèm hàng đợi có giới hạn.
+
+    Hàng đợi đầy -> 429, chờ quá lâu hoặc hết budget media -> 503, luôn kèm Retry-After."""
+
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters = deque()
+        # Thời gian xử lý trung bình (EWMA), dùng để ước lượng Retry-After
+        self.average_duration = 1.0
+
+        QUEUE_DEPTH.labels(queue=f"admission_{name}").set_function(lambda: len(self.waiters))
+        ADMISSION_IN_FLIGHT.labels(endpoint=name).set_function(lambda: self.active)
+
+    def retry_after(self):
+        """Ước lượng số giây đến khi hàng đợi hiện tại được xử lý hết"""
+        backlog = (len(self.waiters) + 1) / self.max_concurrency
+        return max(1, math.ceil(backlog * self.average_duration))
+
+    def _shed(self, status_code, reason):
+        SHED_REQUESTS.labels(endpoint=self.name, reason=reason).inc()
+        logger.warning("Request shed", extra={"endpoint": self.name, "reason": reason, "active": self.active, "waiting": len(self.waiters)})
+        return Overloaded(status_code, reason, self.retry_after())
+
+    def _release(self):
+        # Chuyển slot cho request đang chờ lâu nhất, không thì trả slot
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    async def _acquire(self):
+        if self.active < self.max_concurrency and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            raise self._shed(429, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, max(remaining_time(self.queue_timeout), 0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Đã được chuyển slot đúng lúc bị huỷ: chuyển tiếp cho request sau
+                self._release()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._shed(503, "queue_timeout") from None
+            raise
+
+    @asynccontextmanager
+    async def admit(self, media_count=0):
+        """Giữ một slot xử lý (và chỗ trong budget media) trong suốt request"""
+        # Một request luôn chạy được khi budget đang trống, kể cả khi ước lượng lớn hơn budget
+        estimate = min(media_count * Config.ADMISSION_MEDIA_ESTIMATE_BYTES, media_budget.max_bytes)
+        if estimate and not media_budget.has_room(estimate):
+            raise self._shed(503, "media_budget")
+
+        await self._acquire()
+        # Kiểm tra lại sau khi chờ trong hàng đợi và giữ chỗ ngay (không có await ở giữa)
+        if estimate and not media_budget.try_reserve(estimate):
+            self._release()
+            raise self._shed(503, "media_budget")
+        counter = [estimate, 0]
+        token = _request_media_bytes.set(counter)
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            _request_media_bytes.reset(token)
+            media_budget.release(counter[0] + counter[1])
+            self.average_duration = 0.9 * self.average_duration + 0.1 * (time.monotonic() - start_time)
+            self._release()
+
+async def run_admitted(controller, media_count, func, *args):
+    """Chạy func sau khi được nhận vào (dùng trong task của run_with_deadline)"""
+    async with controller.admit(media_count):
+        return await func(*args)
+
+analyze_admission = AdmissionController(
+    "analyze",
+    Config.ADMISSION_ANALYZE_CONCURRENCY,
+    Config.ADMISSION_ANALYZE_QUEUE,
+    Config.ADMISSION_ANALYZE_QUEUE_TIMEOUT
+)
+vectorize_admission = AdmissionController(
+    "vectorize",
+    Config.ADMISSION_VECTORIZE_CONCURRENCY,
+    Config.ADMISSION_VECTORIZE_QUEUE,
+    Config.ADMISSION_VECTORIZE_QUEUE_TIMEOUT
+)
+
+MEDIA_BYTES_IN_FLIGHT.set_function(lambda: media_budget.in_flight)
@@ -5,6 +5,12 @@ from typing import List, Tuple
 from collections import defaultdict
 import google.generativeai as genai
 from app.config import Config
+from .logger import get_logger, redact_key
+from .deadline import DeadlineExceeded, check_deadline, wait_for_deadline
+from .gemini_prompts import ResponseTruncated
+from .metrics import GEMINI_ERRORS, RATE_LIMIT_SLEEPS, RATE_LIMIT_SLEEP_SECONDS, KEY_POOL_KEYS, QUEUE_DEPTH
+
+logger = get_logger(__name__)
 
 class APIKeyManager:
     def __init__(self):
@@ -35,7 +41,7 @@ class APIKeyManager:
         """Reset daily usage counter nếu sang ngày mới"""
         current_date = time.strftime("%Y-%m-%d")
         if current_date != self.last_reset_date:
-            print(f"Resetting daily usage counters for new day: {current_date}")
+            logger.info("Resetting daily usage counters", extra={"date": current_date})
             self.daily_usage.clear()
             self.last_reset_date = current_date
 
@@ -47,7 +53,7 @@ class APIKeyManager:
         for key in keys_pool:
             # Check daily limit (900/1000 để có buffer)
             if self.daily_usage[key] >= 900:
-                print(f"API key {key[:10]}... reached daily limit, skipping")
+                logger.debug("API key reached daily limit, skipping", extra={"key": redact_key(key)})
                 continue
                 
             # Check if semaphore is available
@@ -74,11 +80,11 @@ class APIKeyManager:
             top_keys = available_keys[:min(5, len(available_keys))]
             selected_key = random.choice(top_keys)
             
-            print(f"Selected analysis key: {selected_key[:10]}... (usage: {self.analysis_usage_count[selected_key]}, daily: {self.daily_usage[selected_key]})")
+            logger.debug("Selected analysis key", extra={"key": redact_key(selected_key), "usage": self.analysis_usage_count[selected_key], "daily": self.daily_usage[selected_key]})
             return selected_key, self.analysis_semaphores[selected_key]
         
         # Nếu không có key nào available, chọn key có usage ít nhất và đợi
-        print("All analysis keys busy, selecting least used key...")
+        logger.info("All analysis keys busy, selecting least used key")
         least_used_key = min(self.analysis_keys, key=lambda k: self.analysis_usage_count[k])
         return least_used_key, self.analysis_semaphores[least_used_key]
 
@@ -95,19 +101,44 @@ class APIKeyManager:
             top_keys = available_keys[:min(3, len(available_keys))]
             selected_key = random.choice(top_keys)
             
-            print(f"Selected search key: {selected_key[:10]}... (usage: {self.search_usage_count[selected_key]}, daily: {self.daily_usage[selected_key]})")
+            logger.debug("Selected search key", extra={"key": redact_key(selected_key), "usage": self.search_usage_count[selected_key], "daily": self.daily_usage[selected_key]})
             return selected_key, self.search_semaphores[selected_key]
         
         # Fallback
-        print("All search keys busy, selecting least used key...")
+        logger.info("All search keys busy, selecting least used key")
         least_used_key = min(self.search_keys, key=lambda k: self.search_usage_count[k])
         return least_used_key, self.search_semaphores[least_used_key]
 
+    def _pool_name(self, api_key) -> str:
+        return "analysis" if api_key in self.analysis_semaphores else "search"
+
+    def get_pool_states(self, pool: str):
+        """Đếm số key theo trạng thái (available / busy / exhausted) cho metrics"""
+        keys = self.analysis_keys if pool == "analysis" else self.search_keys
+        semaphores = self.analysis_semaphores if pool == "analysis" else self.search_semaphores
+        states = {"available": 0, "busy": 0, "exhausted": 0}
+        for key in keys:
+            if self.daily_usage[key] >= 900:
+                states["exhausted"] += 1
+            elif semaphores[key].locked():
+                states["busy"] += 1
+            else:
+                states["available"] += 1
+        return states
+
+    def get_waiting_count(self, pool: str) -> int:
+        """Số request đang chờ semaphore của các key trong pool"""
+        semaphores = self.analysis_semaphores if pool == "analysis" else self.search_semaphores
+        return sum(len(getattr(semaphore, "_waiters", None) or ()) for semaphore in semaphores.values())
+
     async def make_request_with_rate_limit(self, api_key: str, request_func, *args, **kwargs):
         """Thực hiện request với intelligent rate limiting"""
+        pool = self._pool_name(api_key)
+
         # Check daily limit trước khi request
         self._reset_daily_usage_if_needed()
         if self.daily_usage[api_key] >= 900:
+            GEMINI_ERRORS.labels(pool=pool, kind="daily_limit").inc()
             raise Exception(f"API key {api_key[:10]}... reached daily limit")
         
         # Enforce rate limiting per key (4 seconds = 15 req/minute max)
@@ -117,14 +148,22 @@ class APIKeyManager:
         time_since_last = current_time - last_time
         if time_since_last < self.min_delay:
             sleep_time = self.min_delay - time_since_last
-            print(f"Rate limiting: sleeping {sleep_time:.2f}s for key {api_key[:10]}...")
+            # Không ngủ chờ rate limit nếu sau đó không còn đủ thời gian gọi Gemini
+            check_deadline("rate_limit_sleep", sleep_time + Config.DEADLINE_MIN_GEMINI_MS / 1000.0)
+            logger.debug("Rate limiting sleep", extra={"key": redact_key(api_key), "sleep_s": round(sleep_time, 3)})
+            RATE_LIMIT_SLEEPS.labels(pool=pool).inc()
+            RATE_LIMIT_SLEEP_SECONDS.labels(pool=pool).inc(sleep_time)
             await asyncio.sleep(sleep_time)
         
         # Configure API key before request
         genai.configure(api_key=api_key)
         
         try:
-            result = await request_func(*args, **kwargs)
+            # Latency của riêng lời gọi Gemini được đo trong request_func (không tính thời gian tải media)
+            result = await wait_for_deadline(request_func(*args, **kwargs), "gemini")
+            # Các hàm gọi Gemini tự bắt lỗi và trả về None
+            if result is None:
+                GEMINI_ERRORS.labels(pool=pool, kind="empty_response").inc()
             
             # Update counters sau khi request thành công
             self.last_request_time[api_key] = time.time()
@@ -136,13 +175,25 @@ class APIKeyManager:
             elif api_key in self.search_keys:
                 self.search_usage_count[api_key] += 1
             
-            print(f"Request successful. Key {api_key[:10]}... - Session usage: {self.analysis_usage_count[api_key] + self.search_usage_count[api_key]}, Daily: {self.daily_usage[api_key]}")
+            logger.debug("Request successful", extra={"key": redact_key(api_key), "session_usage": self.analysis_usage_count[api_key] + self.search_usage_count[api_key], "daily": self.daily_usage[api_key]})
             
             return result
         except Exception as e:
-            print(f"Error with API key {api_key[:10]}...: {str(e)}")
-            # Vẫn update daily usage kể cả khi lỗi để tránh spam
-            self.daily_usage[api_key] += 1
+            message = str(e).lower()
+            if isinstance(e, DeadlineExceeded):
+                kind = "deadline"
+            elif isinstance(e, ResponseTruncated):
+                kind = "truncated"
+            elif "429" in message or "exhausted" in message:
+                kind = "rate_limited"
+            else:
+                kind = "error"
+            GEMINI_ERRORS.labels(pool=pool, kind=kind).inc()
+            logger.warning("Gemini request failed", extra={"key": redact_key(api_key), "pool": pool, "error": str(e)})
+            # Vẫn update daily usage kể cả khi lỗi để tránh spam; hết deadline (thường trong lúc
+            # tải media, trước khi gọi Gemini) thì không tính quota
+            if kind != "deadline":
+                self.daily_usage[api_key] += 1
             raise e
 
     def get_usage_statistics(self):
@@ -174,4 +225,14 @@ class APIKeyManager:
             "max_daily_capacity": len(self.analysis_keys + self.search_keys) * 900
         }
         
-api_key_manager = APIKeyManager()
\ No newline at end of file
+api_key_manager = APIKeyManager()
+
+# Gauge cho metrics được tính lúc scrape, chỉ theo pool (không lộ key)
+for _pool in ("analysis", "search"):
+    for _state in ("available", "busy", "exhausted"):
+        KEY_POOL_KEYS.labels(pool=_pool, state=_state).set_function(
+            lambda pool=_pool, state=_state: api_key_manager.get_pool_states(pool)[state]
+        )
+    QUEUE_DEPTH.labels(queue=f"{_pool}_key").set_function(
+        lambda pool=_pool: api_key_manager.get_waiting_count(pool)
+    )
\ No newline at end of file
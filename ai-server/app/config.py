@@ -48,7 +48,98 @@ class Config:
         os.getenv("API_KEY_33"),
         os.getenv("API_KEY_34")
     ]
-    
+
+    # Cấu hình embedding: chia văn bản dài thành các window chồng lấp thay vì cắt ở 512 token
+    EMBEDDING_CHUNKED = os.getenv("EMBEDDING_CHUNKED", "true").lower() == "true"
+    EMBEDDING_WINDOW_OVERLAP = int(os.getenv("EMBEDDING_WINDOW_OVERLAP", "64"))
+    EMBEDDING_MAX_WINDOWS = int(os.getenv("EMBEDDING_MAX_WINDOWS", "8"))
+    # Gom các request đang chờ thành một forward pass
+    EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "16"))
+    EMBEDDING_MAX_BATCH_WINDOWS = int(os.getenv("EMBEDDING_MAX_BATCH_WINDOWS", "32"))
+    EMBEDDING_BATCH_WAIT_MS = int(os.getenv("EMBEDDING_BATCH_WAIT_MS", "10"))
+    # Cache token ids cho các chuỗi ngắn hay lặp lại (interest, hobby, category)
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+    TOKEN_CACHE_MAX_CHARS = int(os.getenv("TOKEN_CACHE_MAX_CHARS", "512"))
+
+    # Cấu hình Gemini model cho phân tích nội dung
+    GEMINI_ANALYSIS_MODEL = os.getenv("GEMINI_ANALYSIS_MODEL", "models/gemini-2.0-flash")
+    GEMINI_LITE_MODEL = os.getenv("GEMINI_LITE_MODEL", "models/gemini-2.0-flash-lite")
+    GEMINI_CLARIFY_MODEL = os.getenv("GEMINI_CLARIFY_MODEL", "models/gemini-2.0-flash")
+    # Giới hạn output: tổng số token (0 = tính từ max_items và số từ trong response schema)
+    # và số phần tử tối đa của mỗi list trong response schema
+    GEMINI_ANALYSIS_MAX_OUTPUT_TOKENS = int(os.getenv("GEMINI_ANALYSIS_MAX_OUTPUT_TOKENS", "0"))
+    GEMINI_CLARIFY_MAX_OUTPUT_TOKENS = int(os.getenv("GEMINI_CLARIFY_MAX_OUTPUT_TOKENS", "0"))
+    GEMINI_MAX_LIST_ITEMS = int(os.getenv("GEMINI_MAX_LIST_ITEMS", "10"))
+
+    # Sàng lọc nhanh trước khi gọi Gemini
+    PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+    PREFILTER_SHORT_POST_WORDS = int(os.getenv("PREFILTER_SHORT_POST_WORDS", "40"))
+    # Định tuyến bài ngắn sang model lite: tắt mặc định. Các ngưỡng cosine dưới đây chưa được hiệu chỉnh;
+    # embedding ALBERT không đẳng hướng (cosine giữa hai câu bất kỳ đã cao), cần chọn lại ngưỡng trên
+    # một tập bài đã gắn nhãn trước khi bật
+    PREFILTER_LITE_ENABLED = os.getenv("PREFILTER_LITE_ENABLED", "false").lower() == "true"
+    PREFILTER_WHITELIST_MIN_SIMILARITY = float(os.getenv("PREFILTER_WHITELIST_MIN_SIMILARITY", "0.85"))
+    PREFILTER_MIN_MARGIN = float(os.getenv("PREFILTER_MIN_MARGIN", "0.02"))
+    PREFILTER_RECENT_SIZE = int(os.getenv("PREFILTER_RECENT_SIZE", "1024"))
+
+    # Index topic local cho related topics của /vectorize
+    TOPIC_INDEX_ENABLED = os.getenv("TOPIC_INDEX_ENABLED", "true").lower() == "true"
+    TOPIC_INDEX_MAX_TOPICS = int(os.getenv("TOPIC_INDEX_MAX_TOPICS", "20000"))
+    TOPIC_INDEX_MINE_POSTS = int(os.getenv("TOPIC_INDEX_MINE_POSTS", "5000"))
+    TOPIC_INDEX_MIN_COUNT = int(os.getenv("TOPIC_INDEX_MIN_COUNT", "2"))
+    TOPIC_INDEX_TOP_K = int(os.getenv("TOPIC_INDEX_TOP_K", "12"))
+    # Cosine giữa embedding ALBERT của hai chuỗi bất kỳ thường đã cao, ngưỡng thấp hơn trả về topic không liên quan
+    TOPIC_INDEX_MIN_SIMILARITY = float(os.getenv("TOPIC_INDEX_MIN_SIMILARITY", "0.7"))
+
+    # Hybrid search: BM25 local + vector search (Atlas) gộp bằng reciprocal-rank fusion
+    LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX_ENABLED", "true").lower() == "true"
+    LEXICAL_INDEX_MAX_POSTS = int(os.getenv("LEXICAL_INDEX_MAX_POSTS", "200000"))
+    # Nén index khi số doc đã xoá (bài được index lại hoặc bị gỡ) vượt tỉ lệ này
+    LEXICAL_INDEX_COMPACT_RATIO = float(os.getenv("LEXICAL_INDEX_COMPACT_RATIO", "0.25"))
+    VECTOR_SEARCH_INDEX = os.getenv("VECTOR_SEARCH_INDEX", "vectorPost_index")
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+    HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+    # Vector sở thích của user: khởi tạo từ interest + hobby, cập nhật bằng EMA theo bài đã tương tác
+    USER_VECTOR_COLLECTION = os.getenv("USER_VECTOR_COLLECTION", "UserInterestVector")
+    USER_VECTOR_EMA_ALPHA = float(os.getenv("USER_VECTOR_EMA_ALPHA", "0.1"))
+    USER_VECTOR_MAX_USERS = int(os.getenv("USER_VECTOR_MAX_USERS", "50000"))
+    USER_VECTOR_PROFILE_CACHE_SIZE = int(os.getenv("USER_VECTOR_PROFILE_CACHE_SIZE", "4096"))
+
+    # Cấu hình logging
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_JSON = os.getenv("LOG_JSON", "true").lower() == "true"
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+    LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    # Deadline cho mỗi request (ms), client có thể gửi ngắn hơn qua header X-Request-Timeout-Ms
+    ANALYZE_DEADLINE_MS = int(os.getenv("ANALYZE_DEADLINE_MS", "120000"))
+    VECTORIZE_DEADLINE_MS = int(os.getenv("VECTORIZE_DEADLINE_MS", "30000"))
+    # Thời gian còn lại tối thiểu để còn đáng lấy key và gọi Gemini
+    DEADLINE_MIN_GEMINI_MS = int(os.getenv("DEADLINE_MIN_GEMINI_MS", "1000"))
+    MEDIA_FETCH_TIMEOUT = float(os.getenv("MEDIA_FETCH_TIMEOUT", "20"))
+
+    # Admission control: số request xử lý đồng thời, độ dài hàng đợi và thời gian chờ tối đa (giây)
+    ADMISSION_ANALYZE_CONCURRENCY = int(os.getenv("ADMISSION_ANALYZE_CONCURRENCY", "16"))
+    ADMISSION_ANALYZE_QUEUE = int(os.getenv("ADMISSION_ANALYZE_QUEUE", "64"))
+    ADMISSION_ANALYZE_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_ANALYZE_QUEUE_TIMEOUT", "30"))
+    ADMISSION_VECTORIZE_CONCURRENCY = int(os.getenv("ADMISSION_VECTORIZE_CONCURRENCY", "32"))
+    ADMISSION_VECTORIZE_QUEUE = int(os.getenv("ADMISSION_VECTORIZE_QUEUE", "128"))
+    ADMISSION_VECTORIZE_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_VECTORIZE_QUEUE_TIMEOUT", "5"))
+    # Tổng byte media được giữ trong bộ nhớ cùng lúc, và ước lượng cho mỗi media chưa tải
+    ADMISSION_MAX_MEDIA_BYTES = int(os.getenv("ADMISSION_MAX_MEDIA_BYTES", str(512 * 1024 * 1024)))
+    ADMISSION_MEDIA_ESTIMATE_BYTES = int(os.getenv("ADMISSION_MEDIA_ESTIMATE_BYTES", str(8 * 1024 * 1024)))
+
+    # Profiling on-demand (tắt mặc định), chỉ admin có token mới dùng được
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN")
+    PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+    PROFILING_TRACEMALLOC_FRAMES = int(os.getenv("PROFILING_TRACEMALLOC_FRAMES", "10"))
+    LOOP_LAG_CHECK_INTERVAL_MS = int(os.getenv("LOOP_LAG_CHECK_INTERVAL_MS", "50"))
+    LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+    LOOP_LAG_MAX_EVENTS = int(os.getenv("LOOP_LAG_MAX_EVENTS", "100"))
+
     # Cấu hình ứng dụng
     RELOAD = True  # Thay đổi thành False trong môi trường sản xuất
     HOST = "0.0.0.0"
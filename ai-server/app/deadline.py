@@ -0,0 +1,132 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from .metrics import ABANDONED_REQUESTS
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+class DeadlineExceeded(Exception):
+    """Hết thời gian của request tại một bước trong pipeline"""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded at {stage}")
+        self.stage = stage
+
+class ClientDisconnected(Exception):
+    """Client đã ngắt kết nối, không còn ai đọc kết quả"""
+
+class Deadline:
+    def __init__(self, timeout):
+        self.expires_at = time.monotonic() + timeout
+        # Bước đang chạy, để biết request bị bỏ ở đâu
+        self.stage = "start"
+
+    @classmethod
+    def from_header(cls, value, default_ms):
+        """Deadline từ header X-Request-Timeout-Ms, không dài hơn mặc định của endpoint.
+        Giá trị không hợp lệ (không phải số, nan/inf, <= 0) thì dùng mặc định"""
+        timeout_ms = default_ms
+        try:
+            if value:
+                requested_ms = float(value)
+                if math.isfinite(requested_ms) and requested_ms > 0:
+                    timeout_ms = min(requested_ms, default_ms)
+        except ValueError:
+            pass
+        return cls(timeout_ms / 1000.0)
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+# Deadline của request hiện tại, các task con tạo ra trong request cũng thấy được
+current_deadline = ContextVar("deadline", default=None)
+
+def remaining_time(default):
+    """Thời gian còn lại (giây), không quá default; không có deadline thì trả về default"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    return min(default, deadline.remaining())
+
+def check_deadline(stage, min_remaining=0.0):
+    """Dừng sớm nếu thời gian còn lại không đủ cho bước tiếp theo"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return
+    deadline.stage = stage
+    if deadline.remaining() <= min_remaining:
+        raise DeadlineExceeded(stage)
+
+async def wait_for_deadline(awaitable, stage):
+    """await với timeout là thời gian còn lại của request; hết giờ thì huỷ awaitable"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return await awaitable
+    deadline.stage = stage
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        elif asyncio.isfuture(awaitable):
+            awaitable.cancel()
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage) from None
+
+@asynccontextmanager
+async def acquire_before_deadline(semaphore, stage="key_wait"):
+    """Chờ semaphore (API key) nhưng không quá deadline, luôn release khi xong hoặc bị huỷ"""
+    await wait_for_deadline(semaphore.acquire(), stage)
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+async def _wait_for_disconnect(request):
+    # Body đã được đọc hết, receive() chỉ trả về khi client ngắt kết nối hoặc response đã gửi xong
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def run_with_deadline(request, endpoint, default_ms, func, *args):
+    """Chạy func trong task riêng với deadline của request; huỷ task khi hết giờ hoặc client ngắt kết nối"""
+    deadline = Deadline.from_header(request.headers.get("x-request-timeout-ms"), default_ms)
+
+    async def run():
+        current_deadline.set(deadline)
+        return await func(*args)
+
+    task = asyncio.ensure_future(run())
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, disconnect}, timeout=max(deadline.remaining(), 0), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        disconnect.cancel()
+
+    if task in done:
+        try:
+            return task.result()
+        except DeadlineExceeded as e:
+            ABANDONED_REQUESTS.labels(endpoint=endpoint, reason="deadline", stage=e.stage).inc()
+            logger.info("Request deadline exceeded", extra={"endpoint": endpoint, "stage": e.stage})
+            raise
+
+    # Huỷ pipeline và chờ nó dừng hẳn để semaphore / hàng đợi được giải phóng ngay
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    if disconnect in done:
+        ABANDONED_REQUESTS.labels(endpoint=endpoint, reason="disconnect", stage=deadline.stage).inc()
+        logger.info("Client disconnected, request cancelled", extra={"endpoint": endpoint, "stage": deadline.stage})
+        raise ClientDisconnected()
+    ABANDONED_REQUESTS.labels(endpoint=endpoint, reason="deadline", stage=deadline.stage).inc()
+    logger.info("Request deadline exceeded", extra={"endpoint": endpoint, "stage": deadline.stage})
+    raise DeadlineExceeded(deadline.stage)
@@ -0,0 +1,70 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from app.config import Config
+from .utils import get_chunked_albert_embeddings
+from .metrics import EMBEDDING_ROWS, QUEUE_DEPTH
+from .deadline import wait_for_deadline
+
+class EmbeddingBatcher:
+    def __init__(self, embed_func, max_batch_size, max_wait_ms):
+        self.embed_func = embed_func
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+
+        # Các request đang chờ embed: (text, future)
+        self.pending = []
+        self.worker = None
+
+        # 1 thread duy nhất để các forward pass không chạy chồng lên nhau
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+
+    async def embed(self, text):
+        """Đưa text vào hàng đợi và chờ vector từ forward pass chung"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+
+        if self.worker is None or self.worker.done():
+            self.worker = loop.create_task(self._process_pending())
+
+        # Hết deadline thì future bị huỷ và được bỏ qua khi gom batch
+        return await wait_for_deadline(future, "embedding")
+
+    async def _process_pending(self):
+        """Gom các request đang chờ thành batch và chạy model trong executor"""
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            # Đợi thêm một chút để các request đến cùng lúc được gom chung batch
+            if len(self.pending) < self.max_batch_size and self.max_wait > 0:
+                await asyncio.sleep(self.max_wait)
+
+            batch = self.pending[:self.max_batch_size]
+            del self.pending[:len(batch)]
+
+            # Bỏ qua các request đã bị huỷ trong lúc chờ
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            try:
+                vectors = await loop.run_in_executor(
+                    self.executor, self.embed_func, [text for text, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            EMBEDDING_ROWS.inc(len(batch))
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+embedding_batcher = EmbeddingBatcher(
+    get_chunked_albert_embeddings,
+    Config.EMBEDDING_MAX_BATCH_SIZE,
+    Config.EMBEDDING_BATCH_WAIT_MS
+)
+
+QUEUE_DEPTH.labels(queue="embedding").set_function(lambda: len(embedding_batcher.pending))
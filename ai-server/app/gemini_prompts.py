@@ -0,0 +1,225 @@
+import math
+import google.generativeai as genai
+from app.config import Config
+from .utils import blacklist_categories
+
+# Phần instruction cố định được gửi dưới dạng system instruction, mỗi request chỉ còn nội dung bài viết
+ANALYSIS_SYSTEM_INSTRUCTION = f"""You analyze content for a learning-focused social network.
+
+Your task is to provide a structured analysis of the content, focusing on its educational relevance and appropriateness for a learning community. If it has some media, please analyze the visual elements, subject matter, objects, text in all media (if any), context, and educational relevance. Then, provide a comprehensive analysis that integrates insights from all the text and media, focusing on how they complement or relate to each other.
+If the content is not appropriate, set every text field to "N/A", every list to ["N/A"] and every score to 0, except for Content Appropriateness, which should be "Not Appropriate", and Reasoning.
+
+The analysis must cover the following fields:
+
+1. Main Topics (List of Main Topics identified in the content combined with media if any)
+2. Educational Value (Score assessing educational value (1-10, higher is better))
+3. Relevance to Learning Community (Score assessing relevance (1-10, higher is better))
+4. Content Appropriateness: Evaluate if the content is appropriate for a learning community. Value MUST be either 'Appropriate' or 'Not Appropriate'.
+   Be EXTREMELY STRICT in your evaluation, especially with media. The content must be marked 'Not Appropriate' if ANY of these criteria are met:
+   - Images (Media) showing inappropriate body exposure, suggestive poses, or sexualized content even if subtle or disguised with educational claims
+   - Images (Media) of people deliberately showing off their bodies in ways that are not relevant to educational context
+   - Deliberately provocative content that's trying to bypass filtering by using educational text as cover
+   - Any content that attempts to use educational claims (like "fitness education" or "health tips") as a pretext for sharing inappropriate visual content
+   - For fitness, sports, or physical education content: Only mark as 'Not Appropriate' if the images (media) are excessively revealing, focus primarily on body display rather than demonstrating techniques, or use deliberately provocative poses unrelated to the educational purpose
+   - Content that is not educational or relevant to the learning community
+   - Any of these inappropriate categories: {', '.join(blacklist_categories)}
+   Analyze all the text AND media carefully - treat mismatches between appropriate text and inappropriate media as 'Not Appropriate'
+5. Key Concepts (List of Key Concepts)
+6. Potential Learning Outcomes (List of Potential Learning Outcomes)
+7. Related Academic Disciplines (List of Related Disciplines)
+8. Content Classification (
+    Type: Content Type (e.g., Article, Video, Question, Tutorial),
+    Subject: Subject Matter,
+    Range Age Suitable: Age range suitable (e.g., '13-18 years', 'Adults', 'All Ages', or 'N/A')
+)
+9. Engagement Potential (Score estimating engagement potential (1-100, higher is better))
+10. Credibility and Sources (Score assessing credibility (1-10, higher is better))
+11. Improvement Suggestions (Suggestions for improvement)
+12. Related Topics (List of Related Topics)
+13. Content Tags (List of Tags)
+14. Content Summary (A concise, high-value summary of the main content in English, focusing on the core ideas and key information.
+    The summary should be a short paragraph, not a list, and should avoid generic statements. This summary is intended for semantic vectorization,
+    so it must capture the essence and most important points of the all content and media (if it has good value) clearly and succinctly.)
+15. Reasoning (If the content is not appropriate, please provide a detailed explanation of why it was deemed inappropriate. This should include specific references to the content and media that led to this conclusion. Otherwise "N/A".)
+
+Keep list items short (a few words each) and do not repeat items across lists.
+"""
+
+CLARIFY_SYSTEM_INSTRUCTION = """You are an assistant specializing in analyzing and extracting concise key topics or noun phrases for semantic search and vectorization. Your primary goal is to identify the core intent of the input text and extract relevant keywords or concepts, prioritizing domain-specific knowledge before any secondary aspects (e.g., study skills or strategies). The output must always be clean, concise, and in English, regardless of the input language.
+
+Key Instructions:
+1. Extract primary noun phrases or keywords that represent the core knowledge area or topic of the input text (e.g., "history" and related subfields). Prioritize academic content or factual aspects over secondary skills or techniques.
+2. Rank keywords in descending order of relevance:
+    Begin with keywords or phrases related to the core domain knowledge.
+    Follow with secondary keywords such as strategies, tools, or learning methods.
+3. Suggest related topics or concepts to expand the focus area, ensuring alignment with the input text. Avoid redundancy and unrelated terms.
+4. All outputs must be written in English, even if the input text is in another language (e.g., Vietnamese).
+
+Fields:
+    Main Idea: A concise summary of the user's intent or the primary topic in English.
+    Related Topics: 8-15 related topics or subfields in English, listed in order of relevance:
+        Primary domain-specific keywords ranked by relevance.
+        Additional subtopics or related concepts expanding on the domain.
+        If content is relevant to request document. Bonus some keywords related to learning methods or document, research, share knowledge, exam document about topics and subjects.
+        Keywords related to study strategies or techniques at the end.
+    Summary: A concise, high-value summary of the main content in English, focusing on the core ideas and key information.
+    The summary should be a short paragraph, not a list, and should avoid generic statements. This summary is intended for semantic vectorization,
+    so it must capture the essence and most important points of the content clearly and succinctly.
+
+Example:
+    Input: "Ôn thi học sinh giỏi sử"
+    Main Idea: Preparation for advanced history exams.
+    Related Topics: History (general), Vietnamese history, Vietnamese culture, World history, Historical events (e.g., wars, revolutions), Key historical figures, Historiography (the study of historical writing), Cultural and political history, Document about historical, Document for history exam preparation, THPT High School Graduation Exam, Study materials for history, Exam preparation techniques, Learning strategies for history, Study skills for gifted students, Competitive academic exams
+    Summary: The content focuses on preparing for the history exam for academically gifted students, study strategies, key historical topics, historic document and historic resources tailored for excelling in competitive academic settings. Competition for gifted student.
+
+Ensure domain-specific keywords dominate the list, with skills and strategies positioned only as secondary or supporting concepts.
+Avoid generic modifiers or filler words unless they significantly impact meaning.
+"""
+
+# Ước lượng token cho một từ tiếng Anh và số token JSON (ngoặc, dấu phẩy, key) thêm vào mỗi giá trị
+TOKENS_PER_WORD = 1.5
+JSON_TOKENS_PER_VALUE = 3
+# Số từ tối đa của một phần tử trong list (topic, tag, concept...)
+LIST_ITEM_WORDS = 6
+
+class ResponseTruncated(Exception):
+    """Gemini dừng vì chạm max_output_tokens, JSON trả về bị cắt giữa chừng"""
+
+def _string(description, max_words=10):
+    # "_max_words" chỉ dùng để tính max_output_tokens, được bỏ đi trước khi gửi schema cho Gemini
+    return {"type": "STRING", "description": description, "_max_words": max_words}
+
+def _string_list(description, max_items=None, item_words=LIST_ITEM_WORDS):
+    return {
+        "type": "ARRAY",
+        "items": _string(f"At most {item_words} words", item_words),
+        "max_items": max_items or Config.GEMINI_MAX_LIST_ITEMS,
+        "description": description,
+    }
+
+def _score(description):
+    return {"type": "INTEGER", "description": description}
+
+def _api_schema(schema):
+    """Schema gửi cho Gemini: bỏ các key nội bộ bắt đầu bằng "_" """
+    if isinstance(schema, dict):
+        return {key: _api_schema(value) for key, value in schema.items() if not key.startswith("_")}
+    return schema
+
+def estimate_output_tokens(schema):
+    """Số token tối đa của một response đúng schema (mọi list đầy max_items, mọi chuỗi dài tối đa)"""
+    kind = schema["type"]
+    if kind == "OBJECT":
+        return 2 + sum(
+            len(name.split()) * 2 + JSON_TOKENS_PER_VALUE + estimate_output_tokens(field)
+            for name, field in schema["properties"].items()
+        )
+    if kind == "ARRAY":
+        return 2 + schema["max_items"] * (estimate_output_tokens(schema["items"]) + 1)
+    if kind == "STRING":
+        return math.ceil(schema.get("_max_words", 1) * TOKENS_PER_WORD) + JSON_TOKENS_PER_VALUE
+    return JSON_TOKENS_PER_VALUE
+
+def _output_token_limit(configured, schema):
+    # Config = 0: tính từ schema, cộng 25% dự phòng vì số token mỗi từ chỉ là ước lượng
+    return configured or math.ceil(estimate_output_tokens(schema) * 1.25)
+
+# Schema cho response JSON: Gemini trả về đúng cấu trúc, không cần bỏ code fence rồi mới parse
+ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "Main Topics": _string_list("Main topics of the content and media"),
+        "Educational Value": _score("1-10, 0 if not appropriate"),
+        "Relevance to Learning Community": _score("1-10, 0 if not appropriate"),
+        "Content Appropriateness": {"type": "STRING", "enum": ["Appropriate", "Not Appropriate"]},
+        "Key Concepts": _string_list("Key concepts"),
+        "Potential Learning Outcomes": _string_list("Potential learning outcomes", 5),
+        "Related Academic Disciplines": _string_list("Related academic disciplines", 5),
+        "Content Classification": {
+            "type": "OBJECT",
+            "properties": {
+                "Type": _string("Content type, e.g. Article, Video, Question, Tutorial", 3),
+                "Subject": _string("Subject matter, at most 6 words", 6),
+                "Range Age Suitable": _string("e.g. '13-18 years', 'Adults', 'All Ages' or 'N/A'", 3),
+            },
+            "required": ["Type", "Subject", "Range Age Suitable"],
+        },
+        "Engagement Potential": _score("1-100, 0 if not appropriate"),
+        "Credibility and Sources": _score("1-10, 0 if not appropriate"),
+        "Improvement Suggestions": _string_list("Short suggestions for improvement", 3, 15),
+        "Related Topics": _string_list("Related topics"),
+        "Content Tags": _string_list("Tags"),
+        "Content Summary": _string("One short paragraph in English, at most 80 words", 80),
+        "Reasoning": _string("Why the content is not appropriate, at most 80 words; 'N/A' otherwise", 80),
+    },
+    "required": [
+        "Main Topics", "Educational Value", "Relevance to Learning Community", "Content Appropriateness",
+        "Key Concepts", "Potential Learning Outcomes", "Related Academic Disciplines", "Content Classification",
+        "Engagement Potential", "Credibility and Sources", "Improvement Suggestions", "Related Topics",
+        "Content Tags", "Content Summary", "Reasoning"
+    ],
+}
+
+CLARIFY_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "Main Idea": _string("The user's intent or primary topic in English, one sentence of at most 25 words", 25),
+        "Related Topics": _string_list("8-15 related topics in English, most relevant first", 15),
+        "Summary": _string("One short paragraph in English, at most 60 words", 60),
+    },
+    "required": ["Main Idea", "Related Topics", "Summary"],
+}
+
+ANALYSIS = "analysis"
+CLARIFY = "clarify"
+
+_PROMPTS = {
+    ANALYSIS: (
+        ANALYSIS_SYSTEM_INSTRUCTION,
+        ANALYSIS_RESPONSE_SCHEMA,
+        _output_token_limit(Config.GEMINI_ANALYSIS_MAX_OUTPUT_TOKENS, ANALYSIS_RESPONSE_SCHEMA)
+    ),
+    CLARIFY: (
+        CLARIFY_SYSTEM_INSTRUCTION,
+        CLARIFY_RESPONSE_SCHEMA,
+        _output_token_limit(Config.GEMINI_CLARIFY_MAX_OUTPUT_TOKENS, CLARIFY_RESPONSE_SCHEMA)
+    ),
+}
+
+_models = {}
+
+def get_generative_model(kind, api_key, model_name):
+    """GenerativeModel đã cấu hình system instruction và response schema, dùng lại theo (key, model).
+
+    Model giữ client của key được configure lúc gọi lần đầu, nên phải gọi generate ngay sau hàm này
+    (không await ở giữa) để không lẫn key với request khác."""
+    genai.configure(api_key=api_key)
+    cache_key = (kind, api_key, model_name)
+    model = _models.get(cache_key)
+    if model is None:
+        system_instruction, response_schema, max_output_tokens = _PROMPTS[kind]
+        model = genai.GenerativeModel(
+            model_name,
+            system_instruction=system_instruction,
+            generation_config=genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=_api_schema(response_schema),
+                max_output_tokens=max_output_tokens,
+            ),
+        )
+        _models[cache_key] = model
+    return model
+
+def raise_if_truncated(response, kind):
+    """Raise ResponseTruncated nếu Gemini dừng vì hết max_output_tokens (JSON không parse được)"""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return
+    finish_reason = candidates[0].finish_reason
+    if getattr(finish_reason, "name", finish_reason) in ("MAX_TOKENS", 2):
+        raise ResponseTruncated(f"Gemini {kind} response truncated at {_PROMPTS[kind][2]} output tokens")
+
+def format_clarification(result):
+    """Đưa kết quả clarify (JSON) về dạng text cũ để extract_related_topics_for_embedding vẫn dùng được"""
+    topics = "\n".join(f"- {topic}" for topic in result.get("Related Topics", []))
+    return f"Main Idea: {result.get('Main Idea', '')}\nRelated Topics:\n{topics}\nSummary: {result.get('Summary', '')}"
@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import math
+import threading
+from array import array
+import numpy as np
+from app.config import Config
+from .utils import preprocess_text, collection
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+class LexicalIndex:
+    """Inverted index BM25 trong bộ nhớ cho text bài viết và Content Tags.
+
+    Postings của mỗi term là hai array nén (doc id uint32, term frequency uint16),
+    chỉ thêm vào cuối. Khi bài viết được index lại, doc cũ bị đánh dấu xoá; khi số doc đã xoá
+    vượt compact_ratio thì index được nén lại. Quá max_posts bài thì bỏ các bài cũ nhất.
+    """
+
+    def __init__(self, max_posts, compact_ratio=0.25, k1=1.2, b=0.75):
+        self.max_posts = max_posts
+        self.compact_ratio = compact_ratio
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.post_ids = []
+        self.doc_lengths = array("I")
+        self.alive = bytearray()
+        self.doc_by_post = {}
+        self.total_length = 0
+        self.alive_count = 0
+        self.lock = threading.Lock()
+
+    def tokenize(self, text):
+        return preprocess_text(text or "").split()
+
+    def _remove_locked(self, post_id):
+        doc_id = self.doc_by_post.pop(post_id, None)
+        if doc_id is not None and self.alive[doc_id]:
+            self.alive[doc_id] = 0
+            self.alive_count -= 1
+            self.total_length -= self.doc_lengths[doc_id]
+
+    def _compact_locked(self):
+        """Bỏ các doc đã xoá khỏi postings và đánh lại doc id liên tục"""
+        alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+        remap = np.cumsum(alive, dtype=np.int64) - 1
+        postings = {}
+        for term, (doc_ids, frequencies) in self.postings.items():
+            doc_ids = np.frombuffer(doc_ids.tobytes(), dtype=np.uint32)
+            live = alive[doc_ids]
+            if not live.any():
+                continue
+            frequencies = np.frombuffer(frequencies.tobytes(), dtype=np.uint16)
+            postings[term] = (
+                array("I", remap[doc_ids[live]].astype(np.uint32).tobytes()),
+                array("H", frequencies[live].tobytes())
+            )
+
+        self.postings = postings
+        self.post_ids = [post_id for post_id, is_alive in zip(self.post_ids, self.alive) if is_alive]
+        self.doc_lengths = array("I", np.frombuffer(self.doc_lengths.tobytes(), dtype=np.uint32)[alive].tobytes())
+        self.alive = bytearray(b"\x01" * len(self.post_ids))
+        self.doc_by_post = {post_id: doc_id for doc_id, post_id in enumerate(self.post_ids)}
+
+    def _maybe_compact_locked(self):
+        dead = len(self.post_ids) - self.alive_count
+        if dead and dead >= self.compact_ratio * len(self.post_ids):
+            self._compact_locked()
+
+    def _evict_locked(self):
+        # Post id là ObjectId dạng hex nên sắp theo chuỗi cũng là theo thời gian tạo.
+        # Bỏ thêm một phần nhỏ dưới giới hạn để không phải quét lại ở mỗi lần add
+        excess = self.alive_count - int(self.max_posts * (1 - self.compact_ratio / 2))
+        for post_id in heapq.nsmallest(excess, self.doc_by_post):
+            self._remove_locked(post_id)
+
+    def remove(self, post_id):
+        with self.lock:
+            self._remove_locked(str(post_id))
+            self._maybe_compact_locked()
+
+    def add(self, post_id, text, tags=None):
+        """Index (hoặc index lại) một bài viết"""
+        post_id = str(post_id)
+        terms = self.tokenize(text)
+        for tag in tags or []:
+            terms.extend(self.tokenize(str(tag)))
+
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+
+        with self.lock:
+            self._remove_locked(post_id)
+            doc_id = len(self.post_ids)
+            self.post_ids.append(post_id)
+            self.doc_lengths.append(len(terms))
+            self.alive.append(1)
+            self.doc_by_post[post_id] = doc_id
+            self.total_length += len(terms)
+            self.alive_count += 1
+
+            for term, frequency in frequencies.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = (array("I"), array("H"))
+                postings[0].append(doc_id)
+                postings[1].append(min(frequency, 65535))
+
+            if self.alive_count > self.max_posts:
+                self._evict_locked()
+            self._maybe_compact_locked()
+
+    def contains_all(self, terms):
+        return all(term in self.postings for term in terms)
+
+    def search(self, query, k):
+        """Top k (post_id, score) theo BM25"""
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        with self.lock:
+            if not terms or self.alive_count == 0:
+                return []
+            # Copy buffer (memcpy) để không giữ export của array đang được append
+            matched = [
+                (np.frombuffer(p[0].tobytes(), dtype=np.uint32), np.frombuffer(p[1].tobytes(), dtype=np.uint16))
+                for p in (self.postings.get(term) for term in terms) if p is not None
+            ]
+            if not matched:
+                return []
+            doc_lengths = np.frombuffer(self.doc_lengths.tobytes(), dtype=np.uint32)
+            alive = np.frombuffer(bytes(self.alive), dtype=np.uint8)
+            post_ids = self.post_ids
+            average_length = self.total_length / max(self.alive_count, 1)
+            document_count = self.alive_count
+
+        all_doc_ids = []
+        all_scores = []
+        for doc_ids, frequencies in matched:
+            live = alive[doc_ids] == 1
+            doc_ids = doc_ids[live]
+            if doc_ids.size == 0:
+                continue
+            frequencies = frequencies[live].astype(np.float32)
+            idf = math.log(1 + (document_count - doc_ids.size + 0.5) / (doc_ids.size + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[doc_ids] / max(average_length, 1e-9))
+            all_doc_ids.append(doc_ids)
+            all_scores.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+        if not all_doc_ids:
+            return []
+
+        # Cộng điểm của các term cho cùng một doc
+        unique_ids, inverse = np.unique(np.concatenate(all_doc_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(post_ids[int(unique_ids[i])], float(scores[i])) for i in top]
+
+    def _load_posts(self):
+        """Index các bài viết công khai đã có trong MongoDB"""
+        cursor = collection.find(
+            {"privacy": {"$ne": "Private"}, "isHidden": {"$ne": True}, "type": {"$ne": "answer"}, "isGroupPost": {"$ne": True}},
+            {"post": 1, "analysis.contentTags": 1}
+        ).sort("_id", -1).limit(Config.LEXICAL_INDEX_MAX_POSTS)
+        count = 0
+        for document in cursor:
+            # Bài đã được index trong lúc build (từ /analyze) là bản mới hơn
+            if str(document["_id"]) in self.doc_by_post:
+                continue
+            analysis = document.get("analysis") or {}
+            self.add(document["_id"], document.get("post", ""), analysis.get("contentTags"))
+            count += 1
+        return count
+
+    async def build(self):
+        try:
+            loop = asyncio.get_running_loop()
+            count = await loop.run_in_executor(None, self._load_posts)
+            logger.info("Lexical index built", extra={"posts": count, "terms": len(self.postings)})
+        except Exception as e:
+            logger.error("Error building lexical index", extra={"error": str(e)})
+
+lexical_index = LexicalIndex(Config.LEXICAL_INDEX_MAX_POSTS, Config.LEXICAL_INDEX_COMPACT_RATIO)
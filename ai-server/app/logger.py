@@ -0,0 +1,172 @@
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from app.config import Config
+
+# Request id của request hiện tại, gắn vào mọi log record
+request_id_var = ContextVar("request_id", default=None)
+
+# Các field chuẩn của LogRecord, không đưa vào phần extra của JSON
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "payload_summarized"}
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+def redact_key(api_key):
+    """Định danh ngắn cho API key, không để lộ key trong log"""
+    if not api_key:
+        return "key#none"
+    return "key#" + hashlib.sha1(api_key.encode("utf-8")).hexdigest()[:8]
+
+def summarize_payload(value, max_chars=None, max_items=20):
+    """Rút gọn payload để log: bytes chỉ ghi độ dài, chuỗi dài bị cắt, list/dict bị giới hạn số phần tử"""
+    if max_chars is None:
+        max_chars = Config.LOG_MAX_FIELD_CHARS
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return value[:max_chars] + f"...(+{len(value) - max_chars} chars)"
+        return value
+    if isinstance(value, dict):
+        items = list(value.items())
+        summary = {str(k): summarize_payload(v, max_chars, max_items) for k, v in items[:max_items]}
+        if len(items) > max_items:
+            summary["..."] = f"+{len(items) - max_items} keys"
+        return summary
+    if isinstance(value, (list, tuple)):
+        summary = [summarize_payload(v, max_chars, max_items) for v in value[:max_items]]
+        if len(value) > max_items:
+            summary.append(f"...(+{len(value) - max_items} items)")
+        return summary
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return summarize_payload(str(value), max_chars, max_items)
+
+class RequestContextFilter(logging.Filter):
+    """Gắn request id vào record (chạy trên thread gọi log, trước khi vào queue)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class DebugSamplingFilter(logging.Filter):
+    """Chỉ giữ lại một phần các log DEBUG tần suất cao"""
+
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.sample_rate >= 1:
+            return True
+        return random.random() < self.sample_rate
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        summarized = getattr(record, "payload_summarized", False)
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and key not in entry and key != "request_id":
+                entry[key] = value if summarized else summarize_payload(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _PassthroughQueueHandler(QueueHandler):
+    """Không format trên thread gọi log, để listener định dạng JSON (extra fields đã được rút gọn)"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        # Queue đầy thì bỏ record thay vì chặn request
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        # Rút gọn extra trước khi vào queue: record nằm trong queue không giữ bytes media hay payload lớn
+        for key, value in list(vars(record).items()):
+            if key not in _RESERVED_ATTRS and key != "request_id":
+                setattr(record, key, summarize_payload(value))
+        record.payload_summarized = True
+        return record
+
+_listener = None
+
+def setup_logging():
+    """Cấu hình logging: ghi vào queue (non-blocking), một thread riêng ghi JSON ra stdout"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if Config.LOG_JSON:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    handler = _PassthroughQueueHandler(queue.Queue(maxsize=Config.LOG_QUEUE_SIZE))
+    handler.addFilter(DebugSamplingFilter(Config.LOG_DEBUG_SAMPLE_RATE))
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger("app")
+    root.setLevel(Config.LOG_LEVEL)
+    root.handlers = [handler]
+    root.propagate = False
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+class RequestIdMiddleware:
+    """ASGI middleware: lấy request id từ header X-Request-ID (hoặc tạo mới) và trả lại trong response"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
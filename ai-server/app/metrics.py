@@ -0,0 +1,89 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Bucket đủ rộng cho cả tokenize (ms) lẫn Gemini với media (hàng chục giây)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+# Thời gian từng bước trong pipeline: media_fetch, json_parse, tokenization, forward_pass, mongo_write
+STAGE_LATENCY = Histogram(
+    "ai_server_stage_seconds",
+    "Latency of each stage of the analysis / vectorization pipeline",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+GEMINI_LATENCY = Histogram(
+    "ai_server_gemini_call_seconds",
+    "Latency of the Gemini generate call itself per key pool (excludes media fetch and key wait)",
+    ["pool", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+
+GEMINI_ERRORS = Counter(
+    "ai_server_gemini_errors_total",
+    "Failed Gemini calls per key pool",
+    ["pool", "kind"]
+)
+
+RATE_LIMIT_SLEEPS = Counter(
+    "ai_server_rate_limit_sleeps_total",
+    "Number of times a request slept to respect the per-key rate limit",
+    ["pool"]
+)
+
+RATE_LIMIT_SLEEP_SECONDS = Counter(
+    "ai_server_rate_limit_sleep_seconds_total",
+    "Total time spent sleeping for the per-key rate limit",
+    ["pool"]
+)
+
+CACHE_REQUESTS = Counter(
+    "ai_server_cache_requests_total",
+    "Cache lookups by cache and result (hit / miss)",
+    ["cache", "result"]
+)
+
+EMBEDDING_ROWS = Counter(
+    "ai_server_embedding_rows_total",
+    "Number of texts embedded"
+)
+
+ABANDONED_REQUESTS = Counter(
+    "ai_server_abandoned_requests_total",
+    "Requests stopped early because the deadline expired or the client disconnected",
+    ["endpoint", "reason", "stage"]
+)
+
+SHED_REQUESTS = Counter(
+    "ai_server_shed_requests_total",
+    "Requests rejected by admission control (queue_full / queue_timeout / media_budget)",
+    ["endpoint", "reason"]
+)
+
+# Gauge được tính lúc scrape, không ghi key thật vào label
+KEY_POOL_KEYS = Gauge(
+    "ai_server_key_pool_keys",
+    "Number of API keys per pool by state (available / busy / exhausted)",
+    ["pool", "state"]
+)
+
+QUEUE_DEPTH = Gauge(
+    "ai_server_queue_depth",
+    "Number of requests waiting in internal queues",
+    ["queue"]
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "ai_server_admission_in_flight",
+    "Requests currently admitted per endpoint",
+    ["endpoint"]
+)
+
+MEDIA_BYTES_IN_FLIGHT = Gauge(
+    "ai_server_media_bytes_in_flight",
+    "Bytes of downloaded media held by in-flight requests"
+)
+
+def record_cache(cache, hit, count=1):
+    """Ghi nhận cache hit / miss"""
+    if count > 0:
+        CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc(count)
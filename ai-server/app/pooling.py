@@ -0,0 +1,72 @@
+import math
+import torch
+
+def _weighted_sum(hidden_states, weights):
+    """Tổng có trọng số theo token: (B, L, H) x (B, L) -> (B, H), dùng bmm để không tạo tensor (B, L, H) trung gian"""
+    return torch.bmm(weights.unsqueeze(1).to(hidden_states.dtype), hidden_states).squeeze(1)
+
+def masked_mean_pool(hidden_states, attention_mask):
+    """Mean-pooling chỉ trên các token thật (bỏ qua padding)"""
+    lengths = attention_mask.sum(dim=1, keepdim=True).to(hidden_states.dtype)
+    return _weighted_sum(hidden_states, attention_mask) / lengths.clamp(min=1)
+
+def cls_pool(hidden_states):
+    """Lấy vector của token [CLS]"""
+    return hidden_states[:, 0, :]
+
+def attention_weighted_pool(hidden_states, attention_probs, attention_mask):
+    """Pooling theo lượng attention mà mỗi token nhận được ở layer cuối.
+
+    attention_probs có shape (B, heads, L, L) hoặc (B, L, L) nếu đã lấy trung bình theo head.
+    Chỉ các query là token thật được tính, token padding có trọng số 0.
+    """
+    if attention_probs.dim() == 4:
+        attention_probs = attention_probs.mean(dim=1)
+
+    mask = attention_mask.to(attention_probs.dtype)
+    received = torch.bmm(mask.unsqueeze(1), attention_probs).squeeze(1) * mask
+    return _weighted_sum(hidden_states, received)
+
+class LastLayerAttention:
+    """Tính attention probabilities của riêng layer cuối, thay cho output_attentions=True.
+
+    Hook ghi lại hidden states đầu vào của attention module ở lần gọi cuối cùng
+    (ALBERT dùng chung layer nên các lần gọi trước bị ghi đè), sau đó chỉ tính lại
+    attention cho layer đó. Không phải giữ attention tensor của mọi layer.
+    """
+
+    def __init__(self, model):
+        self.attention_module = model.encoder.albert_layer_groups[-1].albert_layers[-1].attention
+        self.hidden_states = None
+        self.handle = None
+
+    def _capture(self, module, args, kwargs):
+        self.hidden_states = args[0] if args else kwargs["hidden_states"]
+
+    def __enter__(self):
+        self.hidden_states = None
+        self.handle = self.attention_module.register_forward_pre_hook(self._capture, with_kwargs=True)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.handle.remove()
+        self.handle = None
+
+    def probs(self, attention_mask):
+        """Attention probabilities (B, heads, L, L) của layer cuối"""
+        attention = self.attention_module
+        hidden_states = self.hidden_states
+        batch_size, seq_length, _ = hidden_states.shape
+        num_heads = attention.num_attention_heads
+        head_size = attention.attention_head_size
+
+        def split_heads(states):
+            return states.view(batch_size, seq_length, num_heads, head_size).transpose(1, 2)
+
+        query = split_heads(attention.query(hidden_states))
+        key = split_heads(attention.key(hidden_states))
+        scores = torch.matmul(query, key.transpose(-1, -2)) / math.sqrt(head_size)
+
+        padding = (attention_mask[:, None, None, :] == 0)
+        scores = scores.masked_fill(padding, torch.finfo(scores.dtype).min)
+        return scores.softmax(dim=-1)
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.config import Config
+from .utils import whitelist_categories, blacklist_categories, is_meaningful_text, preprocess_text, get_chunked_albert_embeddings
+from .embedding_batcher import embedding_batcher
+from .metrics import record_cache
+
+# Các quyết định của bước pre-screen
+FULL_ANALYSIS = "full"      # Gọi Gemini model đầy đủ
+LITE_ANALYSIS = "lite"      # Bài ngắn, rõ ràng đúng chủ đề -> dùng model rẻ hơn
+EMPTY_CONTENT = "empty"     # Không có chữ có nghĩa và không có media -> không gọi Gemini
+DUPLICATE_CONTENT = "duplicate"  # Trùng nội dung đã phân tích gần đây -> dùng lại kết quả
+
+ANALYSIS_FIELDS = [
+    "Main Topics", "Educational Value", "Relevance to Learning Community", "Content Appropriateness",
+    "Key Concepts", "Potential Learning Outcomes", "Related Academic Disciplines", "Content Classification",
+    "Engagement Potential", "Credibility and Sources", "Improvement Suggestions", "Related Topics",
+    "Content Tags", "Content Summary", "Reasoning"
+]
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+SCORE_FIELDS = ["Educational Value", "Relevance to Learning Community", "Engagement Potential", "Credibility and Sources"]
+LIST_FIELDS = [
+    "Main Topics", "Key Concepts", "Potential Learning Outcomes", "Related Academic Disciplines",
+    "Improvement Suggestions", "Related Topics", "Content Tags"
+]
+
+def empty_analysis():
+    """Kết quả phân tích cho bài không có chữ lẫn media, cùng kiểu dữ liệu với ANALYSIS_RESPONSE_SCHEMA
+    (score là số, list rỗng) để phía Node so sánh score và đọc list như kết quả của Gemini"""
+    analysis = {field: "N/A" for field in ANALYSIS_FIELDS}
+    analysis.update({field: 0 for field in SCORE_FIELDS})
+    analysis.update({field: [] for field in LIST_FIELDS})
+    analysis["Content Classification"] = {"Type": "N/A", "Subject": "N/A", "Range Age Suitable": "N/A"}
+    analysis["Content Appropriateness"] = "Appropriate"
+    analysis["Reasoning"] = "Content has no text or media to analyze."
+    return json.dumps(analysis)
+
+class PreScreenResult:
+    def __init__(self, decision, fingerprint, analysis=None, vector=None):
+        self.decision = decision
+        self.fingerprint = fingerprint
+        self.analysis = analysis
+        self.vector = vector
+
+class ContentPreFilter:
+    def __init__(self):
+        self.whitelist_centroid = None
+        self.blacklist_vectors = None
+        self.centroid_lock = None
+
+        # Kết quả phân tích gần đây theo fingerprint nội dung: (analysis_str, vector)
+        self.recent_results = OrderedDict()
+        self.recent_lock = threading.Lock()
+
+        self.blacklist_pattern = re.compile(
+            r"\b(" + "|".join(re.escape(preprocess_text(c).strip()) for c in blacklist_categories) + r")\b"
+        )
+
+    async def _ensure_centroids(self):
+        """Tính vector cho các category một lần duy nhất, chạy trên thread của embedding"""
+        if self.whitelist_centroid is not None:
+            return
+        if self.centroid_lock is None:
+            self.centroid_lock = asyncio.Lock()
+
+        async with self.centroid_lock:
+            if self.whitelist_centroid is not None:
+                return
+            loop = asyncio.get_running_loop()
+            vectors = await loop.run_in_executor(
+                embedding_batcher.executor,
+                get_chunked_albert_embeddings,
+                [preprocess_text(c) for c in whitelist_categories + blacklist_categories]
+            )
+            vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+            whitelist_vectors = vectors[:len(whitelist_categories)]
+            self.blacklist_vectors = vectors[len(whitelist_categories):]
+            self.whitelist_centroid = _normalize(whitelist_vectors.mean(axis=0))
+
+    def _fingerprint(self, content, media):
+        digest = hashlib.sha1(preprocess_text(content or "").strip().encode("utf-8"))
+        for item in media:
+            digest.update(b"\x00")
+            digest.update(item if isinstance(item, bytes) else str(item).encode("utf-8"))
+        return digest.hexdigest()
+
+    def remember(self, fingerprint, analysis, vector=None):
+        """Lưu kết quả phân tích để dùng lại cho nội dung trùng lặp"""
+        if Config.PREFILTER_RECENT_SIZE <= 0:
+            return
+        with self.recent_lock:
+            self.recent_results[fingerprint] = (analysis, vector)
+            self.recent_results.move_to_end(fingerprint)
+            if len(self.recent_results) > Config.PREFILTER_RECENT_SIZE:
+                self.recent_results.popitem(last=False)
+
+    async def screen(self, content, media):
+        """Sàng lọc nhanh trước khi gọi Gemini, media là danh sách URL hoặc bytes"""
+        text = (content or "").strip()
+        fingerprint = self._fingerprint(text, media)
+
+        if not Config.PREFILTER_ENABLED:
+            return PreScreenResult(FULL_ANALYSIS, fingerprint)
+
+        # Chỉ bỏ qua Gemini khi thật sự không có gì; bài chỉ có emoji / ký hiệu vẫn phải được kiểm duyệt
+        if not media and not text:
+            return PreScreenResult(EMPTY_CONTENT, fingerprint, analysis=empty_analysis())
+
+        with self.recent_lock:
+            cached = self.recent_results.get(fingerprint)
+        record_cache("duplicate_analysis", hit=cached is not None)
+        if cached is not None:
+            return PreScreenResult(DUPLICATE_CONTENT, fingerprint, analysis=cached[0], vector=cached[1])
+
+        if not Config.PREFILTER_LITE_ENABLED:
+            return PreScreenResult(FULL_ANALYSIS, fingerprint)
+
+        # Chỉ bài text ngắn mới được xét dùng model rẻ hơn. Emoji / ký hiệu bị preprocess_text bỏ đi
+        # nên không đánh giá được bằng embedding -> model đầy đủ
+        preprocessed = preprocess_text(text).strip()
+        if not is_meaningful_text(preprocessed):
+            return PreScreenResult(FULL_ANALYSIS, fingerprint)
+        if media or len(preprocessed.split()) > Config.PREFILTER_SHORT_POST_WORDS:
+            return PreScreenResult(FULL_ANALYSIS, fingerprint)
+        if self.blacklist_pattern.search(preprocessed):
+            return PreScreenResult(FULL_ANALYSIS, fingerprint)
+
+        await self._ensure_centroids()
+        vector = _normalize(np.asarray(await embedding_batcher.embed(preprocessed), dtype=np.float32))
+        whitelist_similarity = float(vector @ self.whitelist_centroid)
+        blacklist_similarity = float((self.blacklist_vectors @ vector).max())
+
+        if (whitelist_similarity >= Config.PREFILTER_WHITELIST_MIN_SIMILARITY
+                and whitelist_similarity - blacklist_similarity >= Config.PREFILTER_MIN_MARGIN):
+            return PreScreenResult(LITE_ANALYSIS, fingerprint)
+        return PreScreenResult(FULL_ANALYSIS, fingerprint)
+
+content_prefilter = ContentPreFilter()
@@ -0,0 +1,193 @@
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from app.config import Config
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _folded_stack(frame):
+    """Stack dạng 'outer;...;inner' (folded format của flamegraph.pl / speedscope)"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+def _to_folded_text(counts):
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+
+def sample_cpu_profile(duration, interval):
+    """Sampling profiler: định kỳ chụp stack của mọi thread (trừ thread này) trong duration giây"""
+    counts = Counter()
+    own_thread = threading.get_ident()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            counts[f"{thread_names.get(thread_id, thread_id)};{_folded_stack(frame)}"] += 1
+        time.sleep(interval)
+    return counts
+
+async def take_memory_snapshot(duration, top, group_by):
+    """Bật tracemalloc trong duration giây rồi trả về top allocation"""
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(Config.PROFILING_TRACEMALLOC_FRAMES)
+    try:
+        await asyncio.sleep(duration)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    return snapshot.statistics(group_by)[:top]
+
+class LoopLagMonitor:
+    """Đo độ trễ của event loop. Một watchdog thread chụp stack của loop thread
+    khi loop bị chặn lâu hơn ngưỡng, để biết đoạn code nào đang block."""
+
+    def __init__(self, interval_ms, threshold_ms, max_events):
+        self.interval = interval_ms / 1000.0
+        self.threshold = threshold_ms / 1000.0
+        self.events = deque(maxlen=max_events)
+        self.max_lag = 0.0
+        self.last_beat = None
+        self.loop_thread_id = None
+        self.heartbeat_task = None
+        self.stopped = threading.Event()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.max_lag = max(self.max_lag, now - expected)
+            self.last_beat = now
+
+    def _watchdog(self):
+        captured_for = None
+        while not self.stopped.wait(self.interval):
+            last_beat = self.last_beat
+            if last_beat is None:
+                continue
+            lag = time.monotonic() - last_beat
+            # Chỉ chụp một lần cho mỗi lần loop bị chặn
+            if lag > self.threshold and captured_for != last_beat:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is None:
+                    continue
+                captured_for = last_beat
+                stack = _folded_stack(frame)
+                self.events.append({
+                    "at": time.time(),
+                    "lag_ms": round(lag * 1000, 1),
+                    "stack": stack,
+                })
+                logger.warning("Event loop blocked", extra={"lag_ms": round(lag * 1000, 1), "top_frame": stack.rsplit(";", 1)[-1]})
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="loop-lag-watchdog", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+
+loop_lag_monitor = LoopLagMonitor(
+    Config.LOOP_LAG_CHECK_INTERVAL_MS,
+    Config.LOOP_LAG_THRESHOLD_MS,
+    Config.LOOP_LAG_MAX_EVENTS
+)
+
+class _ProfileSession:
+    """Chỉ cho phép một phiên profile tại một thời điểm"""
+    running = False
+
+    def __enter__(self):
+        if _ProfileSession.running:
+            raise HTTPException(status_code=409, detail="Another profile is running")
+        _ProfileSession.running = True
+
+    def __exit__(self, exc_type, exc, tb):
+        _ProfileSession.running = False
+
+async def require_admin(x_admin_token: str = Header(None)):
+    """Chỉ admin có token đúng mới dùng được các endpoint profiling"""
+    expected = Config.PROFILING_ADMIN_TOKEN
+    if not expected or not x_admin_token or not hmac.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+profiling_router = APIRouter(prefix="/debug", dependencies=[Depends(require_admin)])
+
+def _check_duration(seconds):
+    if seconds <= 0 or seconds > Config.PROFILING_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {Config.PROFILING_MAX_SECONDS}]")
+
+def _attachment(content, filename):
+    return PlainTextResponse(content, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@profiling_router.get('/profile/cpu')
+async def cpu_profile(seconds: float = 10, interval_ms: float = 5):
+    """CPU profile dạng folded stacks, dùng được với flamegraph.pl hoặc speedscope"""
+    _check_duration(seconds)
+    with _ProfileSession():
+        counts = await asyncio.to_thread(sample_cpu_profile, seconds, max(interval_ms, 1) / 1000.0)
+    return _attachment(_to_folded_text(counts), f"cpu-{int(time.time())}.folded")
+
+@profiling_router.get('/profile/memory')
+async def memory_profile(seconds: float = 10, top: int = 25, format: str = "json"):
+    """Top N allocation theo tracemalloc, format json hoặc folded (kích thước theo stack)"""
+    _check_duration(seconds)
+    with _ProfileSession():
+        statistics = await take_memory_snapshot(seconds, top, "traceback" if format == "folded" else "lineno")
+
+    if format == "folded":
+        counts = Counter()
+        for stat in statistics:
+            # Traceback của tracemalloc đã xếp từ frame ngoài cùng vào trong
+            stack = ";".join(f"{os.path.basename(f.filename)}:{f.lineno}" for f in stat.traceback)
+            counts[stack] += stat.size
+        return _attachment(_to_folded_text(counts), f"memory-{int(time.time())}.folded")
+
+    return {
+        "top": [
+            {"location": f"{stat.traceback[-1].filename}:{stat.traceback[-1].lineno}", "size_bytes": stat.size, "count": stat.count}
+            for stat in statistics
+        ]
+    }
+
+@profiling_router.get('/loop-lag')
+async def loop_lag(format: str = "json"):
+    """Các lần event loop bị chặn quá ngưỡng cùng stack tại thời điểm đó"""
+    events = list(loop_lag_monitor.events)
+    if format == "folded":
+        counts = Counter()
+        for event in events:
+            counts[event["stack"]] += int(event["lag_ms"])
+        return _attachment(_to_folded_text(counts), f"loop-lag-{int(time.time())}.folded")
+    return {
+        "threshold_ms": Config.LOOP_LAG_THRESHOLD_MS,
+        "max_lag_ms": round(loop_lag_monitor.max_lag * 1000, 1),
+        "events": events,
+    }
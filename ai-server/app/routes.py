@@ -1,18 +1,37 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Request
+import orjson
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
-from .services import analyze_content, vectorize_query  # Giả sử bạn đã định nghĩa analyze_content trong services.py
+from .services import analyze_content, vectorize_query, hybrid_search  # Giả sử bạn đã định nghĩa analyze_content trong services.py
 from .api_key_manager import api_key_manager
+from app.config import Config
+from .deadline import DeadlineExceeded, ClientDisconnected, run_with_deadline
+from .admission import Overloaded, analyze_admission, vectorize_admission, run_admitted
+from .vector_encoding import BINARY_MEDIA_TYPE, encode_vector_base64, normalize_dtype, pack_vector
+from .user_vectors import user_vector_store
+from .logger import get_logger
 
 router = APIRouter()
+logger = get_logger(__name__)
 
 class AnalyzeRequest(BaseModel):
     value: dict
 class VectorizeRequest(BaseModel):
     value: dict
+class HybridSearchRequest(BaseModel):
+    value: dict
+class UserVectorRequest(BaseModel):
+    value: dict
+class EngagementRequest(BaseModel):
+    value: dict
+
+def _orjson_response(content):
+    # orjson serialize thẳng numpy array, không qua list float của Python (ORJSONResponse đã deprecated)
+    return Response(content=orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
 
 @router.post('/analyze')
-async def analyze_post(request: AnalyzeRequest):
+async def analyze_post(request: AnalyzeRequest, http_request: Request):
     try:
         value = request.value
         content = value['post']
@@ -54,15 +73,43 @@ async def analyze_post(request: AnalyzeRequest):
             url = f"https://res.cloudinary.com/di6ozapw8/video/upload/v{version}/{video_id}"
             video_urls = url
         id = value['_id']
-        result = await analyze_content(content, id, image_urls, video_urls, audio_urls)  # Gọi hàm phân tích nội dung
+        # Chỉ bài công khai mới được đưa vào index tìm kiếm
+        searchable = value.get('privacy') != 'Private' and value.get('type') != 'answer' and not value.get('isGroupPost', False)
+        media_count = sum(len(urls) if isinstance(urls, list) else 1 for urls in (image_urls, video_urls, audio_urls) if urls)
+        result = await run_with_deadline(
+            http_request, "analyze", Config.ANALYZE_DEADLINE_MS,
+            run_admitted, analyze_admission, media_count,
+            analyze_content, content, id, image_urls, video_urls, audio_urls, searchable
+        )  # Gọi hàm phân tích nội dung
         return JSONResponse(content=result)
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client disconnected")
     except Exception as e:
-        print("Error:", str(e))
+        logger.error("Request failed", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.post('/vectorize')
-async def vectorize(request: VectorizeRequest):
+async def vectorize(request: VectorizeRequest, http_request: Request, encoding: str = "json", dtype: str = "float32"):
+    """Vector của query.
+
+    Mặc định trả JSON (orjson, vector là mảng số float32). encoding=base64 trả vector dạng base64 trong JSON,
+    header Accept: application/octet-stream trả binary (xem vector_encoding.py); chỉ hai dạng này nhận dtype
+    float32 hoặc float16, JSON thường với dtype khác float32 trả về 400.
+    """
     try:
+        try:
+            dtype = normalize_dtype(dtype)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if encoding not in ("json", "base64"):
+            raise HTTPException(status_code=400, detail=f"Unsupported encoding: {encoding}")
+        binary = BINARY_MEDIA_TYPE in http_request.headers.get("accept", "")
+        if dtype != "float32" and encoding == "json" and not binary:
+            raise HTTPException(status_code=400, detail=f"dtype={dtype} requires encoding=base64 or Accept: {BINARY_MEDIA_TYPE}")
         value = request.value  # Lấy dữ liệu từ request
         query_text = value['query']  # Lấy văn bản truy vấn từ request
         image = value.get('image', None)
@@ -74,24 +121,120 @@ async def vectorize(request: VectorizeRequest):
         userHobbies = value.get('userHobbies', None)
         if userHobbies == '':
             userHobbies = None
+        userId = value.get('userId', None) or None
         
         # Nhận kết quả từ vectorize_query
-        result = await vectorize_query(query_text, image, userInterest, userHobbies)
+        result = await run_with_deadline(
+            http_request, "vectorize", Config.VECTORIZE_DEADLINE_MS,
+            run_admitted, vectorize_admission, 1 if image is not None else 0,
+            vectorize_query, query_text, image, userInterest, userHobbies, userId
+        )
 
         # Kiểm tra lỗi
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
             
-        # Trả về cả vector và related_topics
-        return JSONResponse(content={
-            "vector": result["vector"].tolist(),
+        meta = {
             "related_topics": result["related_topics"],
             "preprocessed_query": result["preprocessed_query"]
+        }
+        if binary:
+            return Response(content=pack_vector(result["vector"], meta, dtype), media_type=BINARY_MEDIA_TYPE)
+        if encoding == "base64":
+            return _orjson_response({
+                "vector": encode_vector_base64(result["vector"], dtype),
+                "vector_dtype": dtype,
+                "vector_dim": len(result["vector"]),
+                **meta
+            })
+
+        # Trả về cả vector và related_topics
+        return _orjson_response({
+            "vector": result["vector"],
+            **meta
         })
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client disconnected")
     except Exception as e:
-        print("Error:", str(e))
+        logger.error("Request failed", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
     
+@router.post('/search/hybrid')
+async def search_hybrid(request: HybridSearchRequest):
+    """Tìm kiếm kết hợp BM25 (local) và vector, gộp bằng reciprocal-rank fusion"""
+    try:
+        value = request.value
+        query = value.get('query', '')
+        if not query or not query.strip():
+            raise HTTPException(status_code=400, detail="query is required")
+        limit = min(max(int(value.get('limit', 10)), 1), 100)
+        return JSONResponse(content=await hybrid_search(query, limit))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Request failed", extra={"error": str(e)})
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _user_vector_response(user_id, profile):
+    return JSONResponse(content={
+        "user_id": user_id,
+        "vector": profile["vector"].tolist(),
+        "engagements": profile["engagements"],
+        "updated_at": profile["updated_at"]
+    })
+
+@router.get('/users/{user_id}/vector')
+async def get_user_vector(user_id: str):
+    """Vector sở thích đã tính sẵn của user"""
+    profile = await user_vector_store.get(user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User vector not found")
+    return _user_vector_response(user_id, profile)
+
+@router.put('/users/{user_id}/vector')
+async def build_user_vector(user_id: str, request: UserVectorRequest):
+    """Khởi tạo vector từ interest + hobby (gọi khi user tạo hoặc sửa profile)"""
+    try:
+        value = request.value
+        profile = await user_vector_store.build(user_id, value.get('userInterest'), value.get('userHobbies'))
+        if profile is None:
+            raise HTTPException(status_code=400, detail="userInterest or userHobbies is required")
+        return _user_vector_response(user_id, profile)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Request failed", extra={"error": str(e)})
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post('/users/{user_id}/engagements')
+async def record_user_engagement(user_id: str, request: EngagementRequest):
+    """Cập nhật vector của user theo bài viết vừa tương tác (like, comment, save...)"""
+    try:
+        value = request.value
+        post_id = value.get('postId')
+        if not post_id:
+            raise HTTPException(status_code=400, detail="postId is required")
+        profile = await user_vector_store.record_engagement(user_id, post_id, float(value.get('weight', 1.0)))
+        if profile is None:
+            raise HTTPException(status_code=404, detail="Post embedding not found")
+        return _user_vector_response(user_id, profile)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Request failed", extra={"error": str(e)})
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get('/metrics')
+async def metrics():
+    """Prometheus metrics: latency từng bước, trạng thái key pool, queue, cache"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Optional: Health check endpoint to monitor API key status
 @router.get('/api-status')
 async def get_api_status():
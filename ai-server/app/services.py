@@ -1,75 +1,51 @@
-import re, json, traceback
+import re, json, asyncio, time
 from app.config import Config
 import google.generativeai as genai
 from .utils import blacklist_categories, is_meaningful_text, preprocess_text, combine_text, get_albert_embedding, get_improved_embedding, get_attention_weighted_embedding, store_vector_in_mongodb, collection, extract_related_topics_for_embedding
 from .api_key_manager import api_key_manager
+from .embedding_batcher import embedding_batcher
+from .prefilter import content_prefilter, LITE_ANALYSIS, EMPTY_CONTENT, DUPLICATE_CONTENT
+from .topic_index import topic_index
+from .lexical_index import lexical_index
+from .gemini_prompts import get_generative_model, format_clarification, raise_if_truncated, ResponseTruncated, ANALYSIS, CLARIFY
+from .user_vectors import user_vector_store
+from .metrics import STAGE_LATENCY, GEMINI_LATENCY
+from .deadline import DeadlineExceeded, check_deadline, remaining_time, acquire_before_deadline
+from .admission import track_media_bytes
+from .logger import get_logger
 import base64
 import requests
+from bson import ObjectId
 
 # genai.configure(api_key=Config.API_KEY)
 
-async def clarify_text_for_vectorization(text, image=None, api_key=None):
+logger = get_logger(__name__)
+
+async def fetch_media(url):
+    """Tải media trong thread riêng (không chặn event loop), timeout theo deadline của request"""
+    check_deadline("media_fetch")
+    with STAGE_LATENCY.labels(stage="media_fetch").time():
+        response = await asyncio.to_thread(requests.get, url, timeout=remaining_time(Config.MEDIA_FETCH_TIMEOUT))
+    # Media nằm trong bộ nhớ đến khi request xong, tính vào budget của admission control
+    track_media_bytes(len(response.content))
+    return response
+
+async def generate_content_timed(model, contents, pool):
+    """Gọi Gemini và chỉ đo thời gian của chính lời gọi này (không gồm tải media, chờ key)"""
+    start_time = time.perf_counter()
+    outcome = "error"
     try:
-        genai.configure(api_key=api_key)  # Cấu hình API key cho Gemini
-        # Sử dụng Gemini để làm rõ ý nghĩa của văn bản
-        model = genai.GenerativeModel('models/gemini-2.0-flash')
-        prompt = f"""You are an assistant specializing in analyzing and extracting concise key topics or noun phrases for semantic search and vectorization. Your primary goal is to identify the core intent of the input text and extract relevant keywords or concepts, prioritizing domain-specific knowledge before any secondary aspects (e.g., study skills or strategies). The output must always be clean, concise, and in English, regardless of the input language.
-
-        Key Instructions:
-        1. Extract primary noun phrases or keywords that represent the core knowledge area or topic of the input text (e.g., "history" and related subfields). Prioritize academic content or factual aspects over secondary skills or techniques.
-        2. Rank keywords in descending order of relevance:
-            Begin with keywords or phrases related to the core domain knowledge.
-            Follow with secondary keywords such as strategies, tools, or learning methods.
-        3. Suggest related topics or concepts to expand the focus area, ensuring alignment with the input text. Avoid redundancy and unrelated terms.
-        4. All outputs must be written in English, even if the input text is in another language (e.g., Vietnamese).
-        
-        Input Text: '{text}'
-
-        Output Structure:
-            Main Idea: [A concise summary of the user's intent or the primary topic in English.]
-            Related Topics: (At least 8-15 related topics or subfields in English, listed in order of relevance.)
-                [Primary domain-specific keywords ranked by relevance.]
-                [Additional subtopics or related concepts expanding on the domain.]
-                [If content is relevant to request document. Bonus some keywords related to learning methods or document, research, share knowledge, exam document about topics and subjects.]
-                [Keywords related to study strategies or techniques at the end.]
-            Summary: (A concise, high-value summary of the main content in English, focusing on the core ideas and key information. 
-            The summary should be a short paragraph, not a list, and should avoid generic statements. This summary is intended for semantic vectorization, 
-            so it must capture the essence and most important points of the content clearly and succinctly.)
-
-        Avoid including unrelated terms or overly broad explanations. Use the following example as a reference format. Begin with the Main Idea, followed by Related Topics, and end with a Summary. Do not include Input Text or any other introductory phrases.:
-        Example Input and Output:
-            Input: "Ôn thi học sinh giỏi sử"
-            Format Output:
-        ---
-
-        - **Main Idea**: Preparation for advanced history exams.
-        - **Related Topics**:
-        - History (general)
-        - Vietnamese history
-        - Vietnamese culture
-        - World history
-        - Historical events (e.g., wars, revolutions)
-        - Key historical figures
-        - Historiography (the study of historical writing)
-        - Cultural and political history
-        - Document about historical
-        - Document for history exam preparation
-        - THPT High School Graduation Exam
-        - Study materials for history
-        - Exam preparation techniques
-        - Learning strategies for history
-        - Study skills for gifted students
-        - Competitive academic exams
-        **The content focuses on preparing for the history exam for academically gifted students, study strategies, key historical topics, historic document and historic resources tailored for excelling in competitive academic settings. Competition for gifted student.**
-
-        ---
-        Provide the result strictly in the format above, ensuring clarity, relevance, and conciseness.
-            - Ensure domain-specific keywords dominate the list, with skills and strategies positioned only as secondary or supporting concepts.
-            - Avoid generic modifiers or filler words unless they significantly impact meaning.
-            - Maintain clean, semantically relevant outputs in English for optimal use in vectorization and semantic search.
-        Return as fast as possible, and avoid unnecessary explanations or context.
-        """
+        response = await model.generate_content_async(contents)
+        outcome = "blocked" if response.prompt_feedback.block_reason else "success"
+        return response
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        GEMINI_LATENCY.labels(pool=pool, outcome=outcome).observe(time.perf_counter() - start_time)
 
+async def clarify_text_for_vectorization(text, image=None, api_key=None):
+    try:
         # prompt = f"""Please clarify the following text to ensure it is meaningful and semantically rich for vectorization purposes. 
         # The text might be short or unclear, so provide a more detailed and clear version, need the result in a paragraph focus on content of text and related keyword, topic by english:
 
@@ -88,7 +64,7 @@ async def clarify_text_for_vectorization(text, image=None, api_key=None):
         # Original Text: '{text}'
         # """
 
-        content_input = []
+        content_input = [f"Input Text: '{text}'"]
         if image is not None:
             image_part = {
                 "mime_type": "image/jpeg",
@@ -102,22 +78,26 @@ async def clarify_text_for_vectorization(text, image=None, api_key=None):
                 Image: [Image is attached below. Please analyze the visual elements, subject matter, objects, text in the image, context, and educational relevance.]
                 
                 Provide a comprehensive analysis that integrates insights from both the text and image, focusing on how they complement or relate to each other.""", 
-                image_part,
-                prompt
+                image_part
             ]
-            response = await model.generate_content_async(content_input)
-        else:
-            # Nếu chỉ có text, sử dụng prompt thông thường
-            response = await model.generate_content_async(prompt)
+
+        # Instruction cố định nằm trong system instruction của model, request chỉ gửi input
+        model = get_generative_model(CLARIFY, api_key, Config.GEMINI_CLARIFY_MODEL)
+        response = await generate_content_timed(model, content_input, "search")
 
         if response.prompt_feedback.block_reason:
-            print(f"Response blocked. Reason: {response.prompt_feedback.block_reason}")
+            logger.warning("Gemini clarification blocked", extra={"block_reason": str(response.prompt_feedback.block_reason)})
             return None
+        # Chạm max_output_tokens thì JSON bị cắt, không parse được
+        raise_if_truncated(response, CLARIFY)
         
-        return response.text
+        return format_clarification(json.loads(response.text))
     
+    except ResponseTruncated as e:
+        logger.warning("Gemini clarification truncated", extra={"error": str(e)})
+        raise
     except Exception as e:
-        print(f"Error in Gemini clarification: {str(e)}")
+        logger.error("Error in Gemini clarification", extra={"error": str(e)})
         return None
 
 async def translate_to_english(text):
@@ -128,19 +108,17 @@ async def translate_to_english(text):
         response = model.generate_content(prompt)
     
         if response.prompt_feedback.block_reason:
-            print(f"Response blocked. Reason: {response.prompt_feedback.block_reason}")
+            logger.warning("Gemini translation blocked", extra={"block_reason": str(response.prompt_feedback.block_reason)})
             return None
         
         return response.text
     
     except Exception as e:
-        print(f"Error in Gemini analysis: {str(e)}")
+        logger.error("Error in Gemini translation", extra={"error": str(e)})
         return None
 
-async def analyze_content_with_gemini(content, language, api_key, image_urls=None, video_urls=None, audio_urls=None):
+async def analyze_content_with_gemini(content, language, api_key, image_urls=None, video_urls=None, audio_urls=None, model_name=Config.GEMINI_ANALYSIS_MODEL):
     try:
-        genai.configure(api_key=api_key)  # Cấu hình API key cho Gemini
-        model = genai.GenerativeModel('models/gemini-2.0-flash')
         # prompt = f"""Analyze the following content by english for a learning-focused social network:
 
         # Content: "{content}"
@@ -163,49 +141,10 @@ async def analyze_content_with_gemini(content, language, api_key, image_urls=Non
         # 13. Content Tags (Array[Tags])
 
         # Format your response as a JSON object with these keys."""
-        prompt = f"""Analyze the following content for a learning-focused social network:
-
-        Content: "{content}"
+        # Instruction và schema nằm trong system instruction / response schema của model,
+        # mỗi request chỉ gửi nội dung bài viết và media
+        prompt = f"""Content: "{content}"
         Language: {language}
-
-        Your task is to provide a structured analysis of the content, focusing on its educational relevance and appropriateness for a learning community. If it has some media, please analyze the visual elements, subject matter, objects, text in all media (if any), context, and educational relevance. Then, provide a comprehensive analysis that integrates insights from all the text and media, focusing on how they complement or relate to each other, it must be follow the format of the JSON object below.
-        If the content is not appropriate, please return the JSON object with all values as "N/A" except for Content Appropriateness, which should be "Not Appropriate".
-        Please return your analysis in JSON format, strictly adhering to the keys defined below. Do not include any introductory or concluding sentences outside of the JSON structure.
-
-        Analysis should cover the following aspects, and be formatted as a JSON object with these keys:
-        
-        1. Main Topics (List of Main Topics identified in the content combined with media if any)
-        2. Educational Value (Score assessing educational value (1-10, higher is better))
-        3. Relevance to Learning Community (Score assessing relevance (1-10, higher is better))
-        4. Content Appropriateness: Evaluate if the content is appropriate for a learning community. Value MUST be either 'Appropriate' or 'Not Appropriate'.
-           Be EXTREMELY STRICT in your evaluation, especially with media. The content must be marked 'Not Appropriate' if ANY of these criteria are met:
-           - Images (Media) showing inappropriate body exposure, suggestive poses, or sexualized content even if subtle or disguised with educational claims
-           - Images (Media) of people deliberately showing off their bodies in ways that are not relevant to educational context
-           - Deliberately provocative content that's trying to bypass filtering by using educational text as cover
-           - Any content that attempts to use educational claims (like "fitness education" or "health tips") as a pretext for sharing inappropriate visual content
-           - For fitness, sports, or physical education content: Only mark as 'Not Appropriate' if the images (media) are excessively revealing, focus primarily on body display rather than demonstrating techniques, or use deliberately provocative poses unrelated to the educational purpose
-           - Content that is not educational or relevant to the learning community
-           - Any of these inappropriate categories: {', '.join(blacklist_categories)}
-           Analyze all the text AND media carefully - treat mismatches between appropriate text and inappropriate media as 'Not Appropriate'
-        5. Key Concepts (List of Key Concepts)
-        6. Potential Learning Outcomes(List of Potential Learning Outcomes)
-        7. Related Academic Disciplines (List of Related Disciplines)
-        8. Content Classification (
-            Type: Content Type (e.g., Article, Video, Question, Tutorial), 
-            Subject: Subject Matter, 
-            Range Age Suitable: Age range suitable (e.g., '13-18 years', 'Adults', 'All Ages', or 'N/A')
-        )
-        9. Engagement Potential (Score estimating engagement potential (1-100, higher is better))
-        10. Credibility and Sources (Score assessing credibility (1-10, higher is better))
-        11. Improvement Suggestions (Suggestions for improvement)
-        12. Related Topics (List of Related Topics)
-        13. Content Tags (List of Tags)
-        14. Content Summary (A concise, high-value summary of the main content in English, focusing on the core ideas and key information. 
-            The summary should be a short paragraph, not a list, and should avoid generic statements. This summary is intended for semantic vectorization, 
-            so it must capture the essence and most important points of the all content and media (if it has good value) clearly and succinctly.)
-        15. Reasoning (If the content is not appropriate, please provide a detailed explanation of why it was deemed inappropriate. This should include specific references to the content and media that led to this conclusion.)
-
-        Ensure that your ENTIRE response is a valid JSON object.
         """
         content_input = []
         media_description = []
@@ -217,8 +156,8 @@ async def analyze_content_with_gemini(content, language, api_key, image_urls=Non
 
             for i, url in enumerate(image_urls):
                 try:
-                    print(f"Processing image {i+1} at URL: {url}")
-                    response = requests.get(url)
+                    logger.debug("Processing image", extra={"index": i + 1, "url": url})
+                    response = await fetch_media(url)
                     if response.status_code == 200:
                         image_bytes = response.content
                         image_part = {
@@ -227,9 +166,11 @@ async def analyze_content_with_gemini(content, language, api_key, image_urls=Non
                         }
                         content_input.append(image_part)
                     else:
-                        print(f"Failed to fetch image {i+1} from URL: {url}, status code: {response.status_code}")
+                        logger.warning("Failed to fetch image", extra={"index": i + 1, "url": url, "status_code": response.status_code})
+                except DeadlineExceeded:
+                    raise
                 except Exception as e:
-                    print(f"Error processing image {i+1} at URL {url}: {str(e)}")
+                    logger.warning("Error processing image", extra={"index": i + 1, "url": url, "error": str(e)})
             # image_part = {
             #     "mime_type": "image/jpeg",
             #     "data": image
@@ -265,7 +206,7 @@ async def analyze_content_with_gemini(content, language, api_key, image_urls=Non
                         content_input.append(f"Video URL: {url}")
                     else:
                         try:
-                            response = requests.get(url)
+                            response = await fetch_media(url)
                             if response.status_code == 200:
                                 video_bytes = response.content
                                 video_part = {
@@ -274,9 +215,11 @@ async def analyze_content_with_gemini(content, language, api_key, image_urls=Non
                                 }
                                 content_input.append(video_part)
                             else:
-                                print(f"Failed to fetch video {i+1} from URL: {url}, status code: {response.status_code}")
+                                logger.warning("Failed to fetch video", extra={"index": i + 1, "url": url, "status_code": response.status_code})
+                        except DeadlineExceeded:
+                            raise
                         except Exception as e:
-                            print(f"Error processing video {i+1} at URL {url}: {str(e)}")
+                            logger.warning("Error processing video", extra={"index": i + 1, "url": url, "error": str(e)})
 
         if audio_urls is not None:
             if not isinstance(audio_urls, list):
@@ -287,7 +230,7 @@ async def analyze_content_with_gemini(content, language, api_key, image_urls=Non
 
                 for i, url in enumerate(audio_urls):
                     try:
-                        response = requests.get(url)
+                        response = await fetch_media(url)
                         if response.status_code == 200:
                             audio_bytes = response.content
                             audio_part = {
@@ -296,28 +239,56 @@ async def analyze_content_with_gemini(content, language, api_key, image_urls=Non
                             }
                             content_input.append(audio_part)
                         else:
-                            print(f"Failed to fetch audio {i+1} from URL: {url}, status code: {response.status_code}")
+                            logger.warning("Failed to fetch audio", extra={"index": i + 1, "url": url, "status_code": response.status_code})
+                    except DeadlineExceeded:
+                        raise
                     except Exception as e:
-                        print(f"Error processing audio {i+1} at URL {url}: {str(e)}")
+                        logger.warning("Error processing audio", extra={"index": i + 1, "url": url, "error": str(e)})
 
         if media_description:
             media_summary = f"Analyze the content include: {', '.join(media_description)} and text content."
             content_input.insert(0, media_summary)
-        print(content_input + [prompt])
-        response = await model.generate_content_async(content_input + [prompt])
-        print("Gemini: ", response.text)
+        # Media chỉ được log dưới dạng kích thước, không dump bytes
+        logger.debug("Gemini analysis request", extra={"payload": content_input, "prompt_chars": len(prompt)})
+        model = get_generative_model(ANALYSIS, api_key, model_name)
+        response = await generate_content_timed(model, content_input + [prompt], "analysis")
         
         if response.prompt_feedback.block_reason:
-            print(f"Response blocked. Reason: {response.prompt_feedback.block_reason}")
+            logger.warning("Gemini analysis blocked", extra={"block_reason": str(response.prompt_feedback.block_reason)})
             return None
+        # Chạm max_output_tokens thì JSON bị cắt, không parse được
+        raise_if_truncated(response, ANALYSIS)
 
+        logger.debug("Gemini analysis response", extra={"response": response.text})
         return response.text
     
+    except DeadlineExceeded:
+        raise
+    except ResponseTruncated as e:
+        logger.warning("Gemini analysis truncated", extra={"model": model_name, "error": str(e)})
+        raise
     except Exception as e:
-        print(f"Error in Gemini analysis: {str(e)}")
+        logger.error("Error in Gemini analysis", extra={"error": str(e)})
         return None
 
-async def analyze_content(content, id, image_urls=None, video_urls=None, audio_urls=None):
+def _is_low_value(analysis):
+    """Bài mà backend Node sẽ chuyển sang Private sau khi phân tích (Educational Value và Relevance đều < 2)"""
+    educational_value = analysis.get("Educational Value")
+    relevance = analysis.get("Relevance to Learning Community")
+    return (isinstance(educational_value, (int, float)) and isinstance(relevance, (int, float))
+            and educational_value < 2 and relevance < 2)
+
+def update_lexical_index(id, content, analysis, searchable):
+    """Cập nhật index BM25: chỉ giữ các bài công khai và phù hợp"""
+    if not Config.LEXICAL_INDEX_ENABLED:
+        return
+    if searchable and analysis.get("Content Appropriateness") != "Not Appropriate" and not _is_low_value(analysis):
+        tags = analysis.get("Content Tags", [])
+        lexical_index.add(id, content, tags if isinstance(tags, list) else [tags])
+    else:
+        lexical_index.remove(id)
+
+async def analyze_content(content, id, image_urls=None, video_urls=None, audio_urls=None, searchable=True):
     try:
         # if not is_meaningful_text(content):
         #     content_type = "Special Characters/Numbers"
@@ -363,23 +334,45 @@ async def analyze_content(content, id, image_urls=None, video_urls=None, audio_u
         if isinstance(audio_urls, list) and len(audio_urls) == 0:
             audio_urls = None
 
+        # Sàng lọc nhanh: bài rỗng hoặc trùng lặp không cần gọi Gemini
+        media = []
+        for urls in (image_urls, video_urls, audio_urls):
+            if urls is not None:
+                media.extend(urls if isinstance(urls, list) else [urls])
+        screen = await content_prefilter.screen(content, media)
+        if screen.decision == EMPTY_CONTENT:
+            update_lexical_index(id, content, {}, searchable=False)
+            return screen.analysis
+        if screen.decision == DUPLICATE_CONTENT:
+            if screen.vector is not None:
+                store_vector_in_mongodb(collection, screen.vector, id)
+            update_lexical_index(id, content, json.loads(screen.analysis), searchable)
+            return screen.analysis
+        model_name = Config.GEMINI_LITE_MODEL if screen.decision == LITE_ANALYSIS else Config.GEMINI_ANALYSIS_MODEL
+
+        # Hết hạn (hoặc gần hết) thì dừng luôn, không giữ key cho một kết quả không ai đọc
+        check_deadline("key_wait", Config.DEADLINE_MIN_GEMINI_MS / 1000.0)
+
         # Get API key từ analysis pool
         api_key, semaphore = await api_key_manager.get_analysis_key()
 
-        async with semaphore:
+        async with acquire_before_deadline(semaphore):
             # Use rate-limited request
             gemini_analysis = await api_key_manager.make_request_with_rate_limit(
                 api_key,
                 analyze_content_with_gemini,
-                content, "English", api_key, image_urls, video_urls, audio_urls
+                content, "English", api_key, image_urls, video_urls, audio_urls, model_name
             )
 
         # Phân tích với Gemini
         # gemini_analysis = await analyze_content_with_gemini(content, "English", image_urls, video_urls, audio_urls)
-        cleaned_analysis_str = re.sub(r'```json|```', '', gemini_analysis).strip()
+        # Response schema đảm bảo Gemini trả về JSON thuần, không còn code fence
+        cleaned_analysis_str = gemini_analysis.strip()
 
-        cleaned_analysis = json.loads(cleaned_analysis_str)
+        with STAGE_LATENCY.labels(stage="json_parse").time():
+            cleaned_analysis = json.loads(cleaned_analysis_str)
 
+        vector = None
         if(cleaned_analysis.get("Content Appropriateness") != "Not Appropriate"):
             combined_result = combine_text(
                 content_summary=cleaned_analysis.get("Content Summary", "N/A"),
@@ -392,18 +385,29 @@ async def analyze_content(content, id, image_urls=None, video_urls=None, audio_u
                 potential_outcomes=cleaned_analysis.get("Potential Learning Outcomes", [])
             )
             combined_result = preprocess_text(combined_result)
-            print(f"Combined_result: {combined_result}")
-            vector = get_albert_embedding(combined_result).tolist()
+            logger.debug("Combined analysis text", extra={"combined_text": combined_result})
+            vector = (await embedding_batcher.embed(combined_result)).tolist()
             store_vector_in_mongodb(collection, vector, id)
 
+            # Mở rộng topic index bằng các topic mới ở background
+            if Config.TOPIC_INDEX_ENABLED:
+                topics = []
+                for field in ("Main Topics", "Related Topics"):
+                    value = cleaned_analysis.get(field, [])
+                    topics.extend(value if isinstance(value, list) else [value])
+                asyncio.create_task(topic_index.add_topics(topics))
+
+        update_lexical_index(id, content, cleaned_analysis, searchable)
+        content_prefilter.remember(screen.fingerprint, cleaned_analysis_str, vector)
         return cleaned_analysis_str
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"Error in content analysis: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error in content analysis", extra={"post_id": str(id)})
         return {"error": str(e)}
     
-async def vectorize_query(query, image=None, userInterest=None, userHobbies=None):
+async def vectorize_query(query, image=None, userInterest=None, userHobbies=None, userId=None):
     try:
         if image is not None:
             # Giải mã base64 nếu cần
@@ -414,19 +418,22 @@ async def vectorize_query(query, image=None, userInterest=None, userHobbies=None
                 elif image.startswith("http://") or image.startswith("https://"):
 
                     try:
-                        response = requests.get(image)
+                        response = await fetch_media(image)
                         if response.status_code == 200:
                             image = response.content
                         else:
-                            print(f"Failed to fetch image from URL: {image}, status code: {response.status_code}")
+                            logger.warning("Failed to fetch image", extra={"url": image, "status_code": response.status_code})
                             image = None
+                    except DeadlineExceeded:
+                        raise
                     except Exception as e:
-                        print(f"Error fetching image from URL: {str(e)}")
+                        logger.warning("Error fetching image", extra={"error": str(e)})
                         image = None
         preprocessed_query = None
         if (query is not None and query != '' and userHobbies is None) or (image is not None):
+            check_deadline("key_wait", Config.DEADLINE_MIN_GEMINI_MS / 1000.0)
             api_key, semaphore = await api_key_manager.get_search_key()
-            async with semaphore:
+            async with acquire_before_deadline(semaphore):
                 query = await api_key_manager.make_request_with_rate_limit(
                     api_key,
                     clarify_text_for_vectorization,
@@ -440,19 +447,136 @@ async def vectorize_query(query, image=None, userInterest=None, userHobbies=None
             if userHobbies is not None or (userInterest is not None and userInterest):
                 preprocessed_query = f"{userInterest} {userHobbies}"
         
-        print(preprocessed_query)
         preprocessed_query = preprocess_text(preprocessed_query)
         related_topics = extract_related_topics_for_embedding(preprocessed_query)
-        print(f"Related topics: {related_topics}")
-        print(f"Preprocessed query: {preprocessed_query}")
 
-        vector = get_albert_embedding(preprocessed_query)
+        if userHobbies is not None and image is None:
+            # Feed: dùng vector sở thích đã tính sẵn của user (gồm cả cập nhật EMA từ tương tác),
+            # chưa có thì embed chuỗi interest + hobby (có cache) thay vì forward pass mỗi request
+            profile = None
+            if userId is not None:
+                # build() chỉ embed lại khi interest/hobby thay đổi, còn lại là đọc cache
+                profile = await user_vector_store.build(userId, userInterest, userHobbies)
+            if profile is not None:
+                vector = profile["vector"]
+            else:
+                vector = await user_vector_store.embed_profile(preprocessed_query)
+        else:
+            vector = await embedding_batcher.embed(preprocessed_query)
+
+        # Không có related topics từ Gemini (bỏ qua clarify) -> tìm topic gần nhất trong index local
+        if not related_topics and Config.TOPIC_INDEX_ENABLED:
+            related_topics = " ".join(topic_index.nearest(vector, Config.TOPIC_INDEX_TOP_K))
+        logger.debug("Vectorized query", extra={"preprocessed_query": preprocessed_query, "related_topics": related_topics})
         return {
             "vector": vector,
             "related_topics": related_topics,
             "preprocessed_query": preprocessed_query
         }
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.exception("Error in vectorize query")
+        return {"error": str(e)}
+
+def is_exact_term_query(query):
+    """Query dạng tên riêng, mã, công thức: trong ngoặc kép, có token vừa chữ vừa số hoặc có toán tử"""
+    stripped = query.strip()
+    if len(stripped) > 1 and stripped[0] == stripped[-1] == '"':
+        return True
+    if any(re.search(r'\d', token) and re.search(r'[a-zA-Z]', token) for token in stripped.split()):
+        return True
+    # Công thức: toán tử nằm giữa hai toán hạng (không dùng sympy để giữ đường này nhanh)
+    return bool(re.search(r'\w\s*[=^+*/<>]\s*\w', stripped))
+
+# Bài được phép xuất hiện trong kết quả tìm kiếm, giống filter của backend Node
+VISIBLE_POST_FILTER = {
+    "privacy": {"$ne": "Private"},
+    "isHidden": {"$ne": True},
+    "type": {"$ne": "answer"},
+    "isGroupPost": {"$ne": True}
+}
+
+def filter_visible_posts(post_ids):
+    """Giữ lại các bài vẫn còn công khai theo MongoDB (một query $in).
+    Index BM25 chỉ được cập nhật khi /analyze chạy, nên bài đã bị ẩn, chuyển Private hoặc xoá
+    sau đó được loại ra ở đây và xoá khỏi index"""
+    object_ids = [ObjectId(post_id) for post_id in post_ids if ObjectId.is_valid(post_id)]
+    visible = {
+        str(document["_id"])
+        for document in collection.find({"_id": {"$in": object_ids}, **VISIBLE_POST_FILTER}, {"_id": 1})
+    }
+    for post_id in post_ids:
+        if post_id not in visible:
+            lexical_index.remove(post_id)
+    return visible
+
+def vector_search_posts(vector, limit):
+    """Vector search trên MongoDB Atlas, cùng index và filter với backend Node"""
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "index": Config.VECTOR_SEARCH_INDEX,
+                "path": "post_embedding",
+                "queryVector": vector,
+                "numCandidates": limit * 5,
+                "limit": limit,
+                "filter": VISIBLE_POST_FILTER
+            }
+        },
+        {"$project": {"_id": 1}}
+    ]
+    return [str(document["_id"]) for document in collection.aggregate(pipeline)]
+
+async def take_visible(entries, limit, needs_check):
+    """limit entry đầu tiên còn công khai; chỉ kiểm tra MongoDB cho các entry sắp trả về
+    (thường một query $in cho limit bài, chỉ query thêm khi có bài bị loại)"""
+    loop = asyncio.get_running_loop()
+    results = []
+    position = 0
+    while len(results) < limit and position < len(entries):
+        batch = entries[position:position + limit - len(results)]
+        position += len(batch)
+        post_ids = [entry["post_id"] for entry in batch if needs_check(entry)]
+        visible = await loop.run_in_executor(None, filter_visible_posts, post_ids) if post_ids else set()
+        results.extend(entry for entry in batch if not needs_check(entry) or entry["post_id"] in visible)
+    return results
+
+async def hybrid_search(query, limit=10):
+    """Tìm bài viết bằng BM25 local và vector search, gộp bằng reciprocal-rank fusion.
+    Không gọi Gemini clarify; query dạng exact-term có kết quả BM25 thì trả về ngay, không embed
+    và không gọi Atlas. Kết quả từ BM25 vẫn cần một query $in tới MongoDB để loại bài đã bị ẩn,
+    chuyển Private hoặc xoá (index chỉ biết khi /analyze chạy), nên nhánh này nhanh bằng một
+    round trip MongoDB chứ không hoàn toàn nằm trong bộ nhớ."""
+    candidates = max(limit, Config.HYBRID_CANDIDATES)
+    lexical_results = lexical_index.search(query, candidates) if Config.LEXICAL_INDEX_ENABLED else []
+
+    if lexical_results and is_exact_term_query(query):
+        entries = [
+            {"post_id": post_id, "score": score, "lexical_rank": rank + 1, "vector_rank": None}
+            for rank, (post_id, score) in enumerate(lexical_results)
+        ]
+        results = await take_visible(entries, limit, lambda entry: True)
+        if results:
+            return {"mode": "lexical", "results": results}
+
+    vector_results = []
+    try:
+        vector = await embedding_batcher.embed(preprocess_text(query))
+        loop = asyncio.get_running_loop()
+        vector_results = await loop.run_in_executor(None, vector_search_posts, vector.tolist(), candidates)
     except Exception as e:
-        print(f"Error in vectorize query: {str(e)}")
-        traceback.print_exc()
-        return {"error": str(e)}
\ No newline at end of file
+        logger.warning("Vector search failed, using lexical results only", extra={"error": str(e)})
+
+    # Reciprocal-rank fusion
+    fused = {}
+    for source, results in (("lexical_rank", [post_id for post_id, _ in lexical_results]), ("vector_rank", vector_results)):
+        for rank, post_id in enumerate(results):
+            entry = fused.setdefault(post_id, {"post_id": post_id, "score": 0.0, "lexical_rank": None, "vector_rank": None})
+            entry["score"] += 1.0 / (Config.HYBRID_RRF_K + rank + 1)
+            entry[source] = rank + 1
+
+    # Vector search đã lọc bằng VISIBLE_POST_FILTER, chỉ cần kiểm tra bài chỉ có trong BM25
+    ranked = sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)
+    results = await take_visible(ranked, limit, lambda entry: entry["vector_rank"] is None)
+    return {"mode": "hybrid", "results": results}
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from collections import Counter
+import numpy as np
+from app.config import Config
+from .utils import whitelist_categories, blacklist_categories, preprocess_text, get_chunked_albert_embeddings, collection
+from .embedding_batcher import embedding_batcher
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+class TopicIndex:
+    """Index embedding của các topic để tìm related topics bằng nearest-neighbour,
+    không cần gọi Gemini. Khởi tạo từ danh sách category, mở rộng bằng topic từ các bài đã phân tích."""
+
+    def __init__(self, max_topics):
+        self.max_topics = max_topics
+        self.labels = []
+        self.known_labels = set()
+        self.vectors = None
+        self.lock = threading.Lock()
+        # Không bao giờ gợi ý các category bị cấm làm related topic
+        self.blocked_labels = {self._normalize_label(c) for c in blacklist_categories}
+
+    def _normalize_label(self, topic):
+        return preprocess_text(str(topic)).strip()
+
+    async def add_topics(self, topics):
+        """Embed các topic chưa có trong index và thêm vào"""
+        with self.lock:
+            new_labels = []
+            for topic in topics:
+                label = self._normalize_label(topic)
+                if label and label != "n a" and label not in self.blocked_labels and label not in self.known_labels and label not in new_labels:
+                    new_labels.append(label)
+            new_labels = new_labels[:max(0, self.max_topics - len(self.labels))]
+            # Đánh dấu trước để các lần gọi song song không embed trùng
+            self.known_labels.update(new_labels)
+        if not new_labels:
+            return
+
+        # Embed từng nhóm nhỏ: executor chỉ có một thread dùng chung với các request embed,
+        # mỗi job ngắn để batch của request được chạy xen giữa thay vì chờ cả index build xong
+        loop = asyncio.get_running_loop()
+        chunk_size = max(1, Config.EMBEDDING_MAX_BATCH_WINDOWS)
+        chunks = []
+        embedded = 0
+        try:
+            for start in range(0, len(new_labels), chunk_size):
+                chunk = new_labels[start:start + chunk_size]
+                chunks.append(await loop.run_in_executor(embedding_batcher.executor, get_chunked_albert_embeddings, chunk))
+                embedded += len(chunk)
+        finally:
+            with self.lock:
+                # Bỏ đánh dấu các topic chưa embed được để lần sau còn thử lại
+                self.known_labels.difference_update(new_labels[embedded:])
+                if chunks:
+                    vectors = np.concatenate([np.asarray(chunk, dtype=np.float32) for chunk in chunks])
+                    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                    self.vectors = vectors if self.vectors is None else np.vstack([self.vectors, vectors])
+                    self.labels.extend(new_labels[:embedded])
+
+    def _mine_topics_from_posts(self):
+        """Lấy các topic hay gặp nhất từ analysis của các bài viết đã lưu"""
+        counts = Counter()
+        cursor = collection.find(
+            {"analysis.relatedTopics.0": {"$exists": True}},
+            {"analysis.mainTopics": 1, "analysis.relatedTopics": 1, "analysis.contentTags": 1}
+        ).sort("_id", -1).limit(Config.TOPIC_INDEX_MINE_POSTS)
+        for document in cursor:
+            analysis = document.get("analysis") or {}
+            for field in ("mainTopics", "relatedTopics", "contentTags"):
+                for topic in analysis.get(field) or []:
+                    counts[self._normalize_label(topic)] += 1
+        return [topic for topic, count in counts.most_common() if count >= Config.TOPIC_INDEX_MIN_COUNT]
+
+    async def build(self):
+        """Build index lúc khởi động: category hợp lệ trước, sau đó topic lấy từ MongoDB"""
+        try:
+            await self.add_topics(whitelist_categories)
+            if Config.TOPIC_INDEX_MINE_POSTS > 0:
+                loop = asyncio.get_running_loop()
+                mined_topics = await loop.run_in_executor(None, self._mine_topics_from_posts)
+                await self.add_topics(mined_topics)
+            logger.info("Topic index built", extra={"topics": len(self.labels)})
+        except Exception as e:
+            logger.error("Error building topic index", extra={"error": str(e)})
+
+    def nearest(self, vector, k):
+        """Trả về k topic gần vector nhất theo cosine similarity"""
+        with self.lock:
+            vectors = self.vectors
+            labels = self.labels
+        if vectors is None or k <= 0:
+            return []
+
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = vectors @ query
+        k = min(k, len(labels))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [labels[i] for i in top if scores[i] >= Config.TOPIC_INDEX_MIN_SIMILARITY]
+
+topic_index = TopicIndex(Config.TOPIC_INDEX_MAX_TOPICS)
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+import numpy as np
+from bson import ObjectId
+from app.config import Config
+from .utils import preprocess_text, collection
+from .embedding_batcher import embedding_batcher
+from .metrics import record_cache
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+class UserVectorStore:
+    """Vector sở thích của từng user: khởi tạo từ interest + hobby, cập nhật dần bằng
+    exponential moving average của embedding các bài user tương tác.
+
+    Vector profile (base) và phần EMA từ tương tác được lưu riêng rồi ghép lại khi đọc:
+        vector = base_weight * base + engagement
+    Mỗi lần tương tác, base_weight và engagement cùng nhân (1 - alpha) rồi engagement cộng alpha * post,
+    nên interest/hobby thay đổi chỉ thay base, không mất phần đã học từ tương tác.
+
+    Giữ trong bộ nhớ (LRU) để đọc O(1), ghi xuống MongoDB để không mất khi restart.
+    """
+
+    def __init__(self, max_users, max_profile_texts):
+        self.max_users = max_users
+        self.max_profile_texts = max_profile_texts
+        self.profiles = OrderedDict()
+        # Cache embedding theo text profile: nhiều request feed dùng lại cùng một chuỗi interest + hobby
+        self.profile_embeddings = OrderedDict()
+        self.storage = collection.database[Config.USER_VECTOR_COLLECTION]
+
+    def _remember(self, cache, key, value, max_size):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+
+    async def embed_profile(self, text):
+        """Embed text profile, dùng lại kết quả nếu text đã được embed trước đó"""
+        vector = self.profile_embeddings.get(text)
+        record_cache("profile_embedding", hit=vector is not None)
+        if vector is not None:
+            self.profile_embeddings.move_to_end(text)
+            return vector
+        vector = np.asarray(await embedding_batcher.embed(text), dtype=np.float32)
+        self._remember(self.profile_embeddings, text, vector, self.max_profile_texts)
+        return vector
+
+    def _combine(self, profile):
+        """Tính lại vector từ base và phần EMA của tương tác"""
+        base, engagement, base_weight = profile["base"], profile["engagement"], profile["base_weight"]
+        if base is None:
+            # Chưa có interest/hobby: chỉ còn phần tương tác, chia lại để tổng trọng số bằng 1
+            profile["vector"] = engagement / max(1.0 - base_weight, 1e-6)
+        elif engagement is None:
+            profile["vector"] = base
+        else:
+            profile["vector"] = (base_weight * base + engagement).astype(np.float32)
+        return profile
+
+    def _load(self, user_id):
+        document = self.storage.find_one({"_id": user_id})
+        if document is None:
+            return None
+        base = document.get("base", document.get("vector"))
+        engagement = document.get("engagement")
+        return self._combine({
+            "base": np.asarray(base, dtype=np.float32) if base is not None else None,
+            "engagement": np.asarray(engagement, dtype=np.float32) if engagement is not None else None,
+            # Document cũ chỉ có "vector": coi như base, chưa có phần tương tác
+            "base_weight": document.get("base_weight", 1.0),
+            "profile_hash": document.get("profile_hash"),
+            "engagements": document.get("engagements", 0),
+            "updated_at": document.get("updated_at", 0),
+        })
+
+    def _save(self, user_id, profile):
+        self.storage.update_one(
+            {"_id": user_id},
+            {"$set": {
+                "vector": profile["vector"].tolist(),
+                "base": profile["base"].tolist() if profile["base"] is not None else None,
+                "engagement": profile["engagement"].tolist() if profile["engagement"] is not None else None,
+                "base_weight": profile["base_weight"],
+                "profile_hash": profile["profile_hash"],
+                "engagements": profile["engagements"],
+                "updated_at": profile["updated_at"],
+            }},
+            upsert=True
+        )
+
+    async def _persist(self, user_id, profile):
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._save, user_id, dict(profile))
+        except Exception as e:
+            logger.warning("Failed to persist user vector", extra={"user_id": user_id, "error": str(e)})
+
+    async def get(self, user_id):
+        """Vector của user: đọc từ bộ nhớ, nếu chưa có thì thử MongoDB"""
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            self.profiles.move_to_end(user_id)
+            record_cache("user_vector", hit=True)
+            return profile
+
+        record_cache("user_vector", hit=False)
+        loop = asyncio.get_running_loop()
+        profile = await loop.run_in_executor(None, self._load, user_id)
+        if profile is not None:
+            # Có thể đã được cập nhật trong lúc đang đọc MongoDB
+            profile = self.profiles.get(user_id, profile)
+            self._remember(self.profiles, user_id, profile, self.max_users)
+        return profile
+
+    async def build(self, user_id, user_interest=None, user_hobbies=None):
+        """Khởi tạo (hoặc làm mới) vector từ interest + hobby; không embed lại nếu profile không đổi.
+        Không có interest/hobby thì trả về vector hiện có (có thể là None)"""
+        text = preprocess_text(f"{user_interest or ''} {user_hobbies or ''}").strip()
+        if not text:
+            return await self.get(user_id)
+        profile_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+        profile = await self.get(user_id)
+        if profile is not None and profile["profile_hash"] == profile_hash:
+            return profile
+
+        base = await self.embed_profile(text)
+        # Có thể đã có tương tác mới trong lúc embed
+        current = self.profiles.get(user_id, profile)
+        if current is None:
+            profile = {"engagement": None, "base_weight": 1.0, "engagements": 0}
+        else:
+            profile = dict(current)
+        # Chỉ thay base, giữ nguyên phần EMA đã học từ tương tác
+        profile["base"] = base
+        profile["profile_hash"] = profile_hash
+        profile["updated_at"] = time.time()
+        self._combine(profile)
+        self._remember(self.profiles, user_id, profile, self.max_users)
+        await self._persist(user_id, profile)
+        return profile
+
+    def _load_post_embedding(self, post_id):
+        if not ObjectId.is_valid(post_id):
+            return None
+        document = collection.find_one({"_id": ObjectId(post_id)}, {"post_embedding": 1})
+        if document is None or not document.get("post_embedding"):
+            return None
+        return np.asarray(document["post_embedding"], dtype=np.float32)
+
+    async def record_engagement(self, user_id, post_id, weight=1.0):
+        """Cập nhật vector bằng EMA với embedding của bài user vừa tương tác"""
+        loop = asyncio.get_running_loop()
+        post_vector = await loop.run_in_executor(None, self._load_post_embedding, post_id)
+        if post_vector is None:
+            return None
+
+        alpha = min(max(Config.USER_VECTOR_EMA_ALPHA * weight, 0.0), 1.0)
+        profile = await self.get(user_id)
+        if profile is None:
+            profile = {"base": None, "engagement": None, "base_weight": 1.0, "profile_hash": None, "engagements": 0}
+        else:
+            profile = dict(profile)
+        engagement = profile["engagement"] if profile["engagement"] is not None else np.zeros_like(post_vector)
+        profile["engagement"] = ((1 - alpha) * engagement + alpha * post_vector).astype(np.float32)
+        profile["base_weight"] *= 1 - alpha
+        profile["engagements"] += 1
+        profile["updated_at"] = time.time()
+        self._combine(profile)
+
+        self._remember(self.profiles, user_id, profile, self.max_users)
+        await self._persist(user_id, profile)
+        return profile
+
+user_vector_store = UserVectorStore(Config.USER_VECTOR_MAX_USERS, Config.USER_VECTOR_PROFILE_CACHE_SIZE)
@@ -1,17 +1,27 @@
 import re
+import threading
 import torch
 import sympy
 from app.config import Config
-from transformers import pipeline, AutoTokenizer, AutoModel, AlbertTokenizer, AlbertModel
+from collections import OrderedDict
+from transformers import pipeline, AutoTokenizer, AutoModel, AlbertTokenizerFast, AlbertModel
 from pymongo import MongoClient
 from bson import ObjectId
 from sklearn.feature_extraction.text import TfidfVectorizer
+from .metrics import STAGE_LATENCY, record_cache
+from .logger import get_logger
+from .pooling import masked_mean_pool, cls_pool, attention_weighted_pool, LastLayerAttention
+
+logger = get_logger(__name__)
 
 db_name = "test"
 collection_name = "Post"
 
-# Khởi tạo tokenizer và model cho ALBERT
-tokenizer = AlbertTokenizer.from_pretrained("albert-base-v2")
+# Số token tối đa ALBERT nhận trong một lần forward
+EMBEDDING_MAX_LENGTH = 512
+
+# Khởi tạo tokenizer (bản fast, Rust-backed) và model cho ALBERT
+tokenizer = AlbertTokenizerFast.from_pretrained("albert-base-v2")
 model = AlbertModel.from_pretrained("albert-base-v2")
 
 # Định nghĩa các danh mục
@@ -42,6 +52,48 @@ categories = whitelist_categories + blacklist_categories
 tfidf = TfidfVectorizer()
 tfidf.fit([' '.join(categories)])
 
+class TokenCache:
+    """LRU cache token ids (không có special tokens) cho các chuỗi ngắn hay lặp lại
+    như interest, hobby, category. Các chuỗi chưa có trong cache được tokenize chung một batch."""
+
+    def __init__(self, maxsize, max_text_length):
+        self.maxsize = maxsize
+        self.max_text_length = max_text_length
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def encode(self, texts):
+        results = [None] * len(texts)
+        misses = {}
+        with self.lock:
+            for i, text in enumerate(texts):
+                token_ids = self.entries.get(text)
+                if token_ids is not None:
+                    self.entries.move_to_end(text)
+                    results[i] = token_ids
+                else:
+                    misses.setdefault(text, []).append(i)
+
+        record_cache("tokens", hit=True, count=len(texts) - sum(len(v) for v in misses.values()))
+        record_cache("tokens", hit=False, count=sum(len(v) for v in misses.values()))
+        if misses:
+            miss_texts = list(misses)
+            with STAGE_LATENCY.labels(stage="tokenization").time():
+                encoded = tokenizer(miss_texts, add_special_tokens=False)["input_ids"]
+            with self.lock:
+                for text, token_ids in zip(miss_texts, encoded):
+                    for i in misses[text]:
+                        results[i] = token_ids
+                    if self.maxsize > 0 and len(text) <= self.max_text_length:
+                        self.entries[text] = token_ids
+                        self.entries.move_to_end(text)
+                        if len(self.entries) > self.maxsize:
+                            self.entries.popitem(last=False)
+
+        return results
+
+token_cache = TokenCache(Config.TOKEN_CACHE_SIZE, Config.TOKEN_CACHE_MAX_CHARS)
+
 def extract_related_topics_for_embedding(preprocessed_query):
     # Tìm phần văn bản giữa "related topics" và "summary"
     pattern = r"related topics([\s\S]*?)(?:summary|$)"
@@ -66,7 +118,7 @@ def connect_to_mongodb(db_name, collection_name):
     client = MongoClient(Config.MONGODB_URI)
     database = client[db_name]
     collection = database[collection_name]
-    print("Connected to MongoDB")
+    logger.info("Connected to MongoDB", extra={"collection": collection_name})
     return collection
 
 collection = connect_to_mongodb(db_name, collection_name)
@@ -78,6 +130,12 @@ def preprocess_text(text):
     text = re.sub(r'\s+', ' ', text)
     return text
 
+# Nạp sẵn các category vào cache, dưới dạng đã tiền xử lý như lúc các hàm embed tra cache
+# (có và không strip: prefilter embed nguyên preprocess_text, topic index strip thêm)
+token_cache.encode(list(dict.fromkeys(
+    form for c in categories for form in (preprocess_text(c), preprocess_text(c).strip())
+)))
+
 def combine_text(content_summary, main_topics, disciplines, key_concepts, range_age_suitable, related_topics, content_tags, potential_outcomes):
     combined_text = f"{content_summary}. {', '.join(main_topics)}. {', '.join(content_tags)}. {', '.join(key_concepts)}. {', '.join(potential_outcomes)}. {', '.join(related_topics)}. {', '.join(disciplines)}. Age Suitable: {range_age_suitable}."
     return combined_text
@@ -109,45 +167,104 @@ def is_meaningful_text(text):
     words = re.findall(r'\b\w+\b', text)
     return len(words) > 0
 
+def _encode(text):
+    return tokenizer(text, return_tensors="pt", truncation=True, max_length=EMBEDDING_MAX_LENGTH, padding=True)
+
 def get_improved_embedding(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512, padding=True)
+    inputs = _encode(text)
     
     with torch.no_grad():
         outputs = model(**inputs)
     
     # Sử dụng [CLS] token thay vì mean-pooling
-    return outputs.last_hidden_state[:, 0, :].squeeze().numpy()
+    return cls_pool(outputs.last_hidden_state).squeeze().numpy()
 
 def get_attention_weighted_embedding(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512, padding=True)
-    
-    with torch.no_grad():
-        outputs = model(**inputs, output_attentions=True)
+    inputs = _encode(text)
     
-    # Lấy last layer attention weights
-    attention = outputs.attentions[-1].mean(dim=1)  # average over heads
+    # Chỉ tính lại attention của layer cuối thay vì output_attentions=True cho mọi layer
+    with torch.no_grad(), LastLayerAttention(model) as last_layer:
+        outputs = model(**inputs)
+        attention = last_layer.probs(inputs["attention_mask"])
     
     # Áp dụng attention weights cho hidden states
-    weighted_states = outputs.last_hidden_state * attention.sum(dim=1).unsqueeze(-1)
-    
-    return weighted_states.sum(dim=1).squeeze().numpy()
+    return attention_weighted_pool(outputs.last_hidden_state, attention, inputs["attention_mask"]).squeeze().numpy()
 
 def get_albert_embedding(text):
     # Tokenize văn bản
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512, padding=True)
+    inputs = _encode(text)
     
     # Lấy embedding từ ALBERT
     with torch.no_grad():
         outputs = model(**inputs)
     
-    # Tính trung bình của các hidden states để tạo vector cho câu
-    return outputs.last_hidden_state.mean(dim=1).squeeze().numpy()
+    # Tính trung bình của các hidden states (bỏ qua padding) để tạo vector cho câu
+    return masked_mean_pool(outputs.last_hidden_state, inputs["attention_mask"]).squeeze().numpy()
+
+def split_into_windows(token_ids, window_size, stride, max_windows):
+    """Chia token ids thành các window chồng lấp nhau, tối đa max_windows window"""
+    if len(token_ids) <= window_size:
+        return [token_ids]
+
+    windows = []
+    for start in range(0, len(token_ids), stride):
+        windows.append(token_ids[start:start + window_size])
+        if start + window_size >= len(token_ids) or len(windows) >= max_windows:
+            break
+    return windows
+
+def get_chunked_albert_embeddings(texts):
+    """Embed nhiều văn bản trong một lần: mỗi văn bản dài được chia thành các window
+    chồng lấp, tất cả window được đưa qua model cùng nhau rồi gộp lại theo độ dài."""
+    max_windows = Config.EMBEDDING_MAX_WINDOWS if Config.EMBEDDING_CHUNKED else 1
+    # Chừa chỗ cho [CLS] và [SEP]
+    window_size = EMBEDDING_MAX_LENGTH - tokenizer.num_special_tokens_to_add()
+    stride = max(1, window_size - Config.EMBEDDING_WINDOW_OVERLAP)
+
+    windows = []
+    owners = []
+    for doc_index, token_ids in enumerate(token_cache.encode(texts)):
+        for window in split_into_windows(token_ids, window_size, stride, max_windows):
+            windows.append(tokenizer.build_inputs_with_special_tokens(window))
+            owners.append(doc_index)
+
+    window_vectors = []
+    window_lengths = []
+    batch_windows = max(1, Config.EMBEDDING_MAX_BATCH_WINDOWS)
+    for start in range(0, len(windows), batch_windows):
+        inputs = tokenizer.pad(
+            {"input_ids": windows[start:start + batch_windows]},
+            padding=True,
+            return_tensors="pt"
+        )
+        with torch.no_grad(), STAGE_LATENCY.labels(stage="forward_pass").time():
+            outputs = model(**inputs)
+
+        # Mean-pooling chỉ trên các token thật của từng window
+        window_vectors.append(masked_mean_pool(outputs.last_hidden_state, inputs["attention_mask"]))
+        window_lengths.append(inputs["attention_mask"].sum(dim=1, keepdim=True).to(window_vectors[-1].dtype))
+
+    window_vectors = torch.cat(window_vectors)
+    window_lengths = torch.cat(window_lengths)
+    owners = torch.tensor(owners, dtype=torch.long)
+
+    # Gộp các window của cùng một văn bản, trọng số là số token của window
+    pooled = torch.zeros(len(texts), window_vectors.size(-1), dtype=window_vectors.dtype)
+    pooled.index_add_(0, owners, window_vectors * window_lengths)
+    total_lengths = torch.zeros(len(texts), 1, dtype=window_lengths.dtype)
+    total_lengths.index_add_(0, owners, window_lengths)
+
+    return (pooled / total_lengths.clamp(min=1)).numpy()
 
 def store_vector_in_mongodb(collection, post_embedding, id):
+    with STAGE_LATENCY.labels(stage="mongo_write").time():
+        _store_vector_in_mongodb(collection, post_embedding, id)
+
+def _store_vector_in_mongodb(collection, post_embedding, id):
     object_id = ObjectId(id)
     document = collection.find_one({"_id": object_id})
     if document is None:
-        print(f"No document found with id: {id}")
+        logger.warning("No document found for vector", extra={"post_id": str(id)})
         return
     
     collection.update_one(
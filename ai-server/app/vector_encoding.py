@@ -0,0 +1,47 @@
+import base64
+import json
+import struct
+import numpy as np
+
+# Định dạng binary của /vectorize (little-endian):
+#   magic "VEC1" | dtype (1 byte) | 3 byte dự trữ | dim (uint32) | meta_len (uint32)
+#   | vector (dim * itemsize byte) | meta JSON (utf-8, meta_len byte)
+# Header 16 byte nên vector bắt đầu ở offset chia hết cho 4, đọc thẳng bằng Float32Array được.
+BINARY_MAGIC = b"VEC1"
+BINARY_HEADER = struct.Struct("<4sB3xII")
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+DTYPES = {"float32": 1, "float16": 2}
+
+def normalize_dtype(dtype):
+    dtype = (dtype or "float32").lower()
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported vector dtype: {dtype}")
+    return dtype
+
+def vector_bytes(vector, dtype="float32"):
+    return np.ascontiguousarray(vector, dtype=np.dtype(normalize_dtype(dtype)).newbyteorder("<")).tobytes()
+
+def encode_vector_base64(vector, dtype="float32"):
+    """Vector dạng base64 (little-endian) để nhúng vào JSON"""
+    return base64.b64encode(vector_bytes(vector, dtype)).decode("ascii")
+
+def pack_vector(vector, meta, dtype="float32"):
+    """Đóng gói vector và metadata theo định dạng binary ở trên"""
+    dtype = normalize_dtype(dtype)
+    data = vector_bytes(vector, dtype)
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    dim = len(data) // np.dtype(dtype).itemsize
+    return BINARY_HEADER.pack(BINARY_MAGIC, DTYPES[dtype], dim, len(meta_bytes)) + data + meta_bytes
+
+def unpack_vector(payload):
+    """Đọc lại payload binary (dùng cho client Python và benchmark)"""
+    magic, dtype_code, dim, meta_len = BINARY_HEADER.unpack_from(payload)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Invalid vector payload")
+    dtype = next(name for name, code in DTYPES.items() if code == dtype_code)
+    offset = BINARY_HEADER.size
+    size = dim * np.dtype(dtype).itemsize
+    vector = np.frombuffer(payload, dtype=np.dtype(dtype).newbyteorder("<"), count=dim, offset=offset)
+    meta = json.loads(payload[offset + size:offset + size + meta_len].decode("utf-8"))
+    return vector, meta
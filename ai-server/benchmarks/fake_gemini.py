@@ -0,0 +1,126 @@
+import asyncio
+import json
+import random
+import google.generativeai as genai
+
+class FakeGeminiSettings:
+    def __init__(self, latency_ms=800.0, latency_spread=0.5, latency_dist="lognormal",
+                 error_rate=0.0, rate_limit_rate=0.0, block_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_spread = latency_spread
+        self.latency_dist = latency_dist
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.block_rate = block_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    def sample_latency(self):
+        """Độ trễ giả lập (giây) theo phân phối đã chọn"""
+        mean = self.latency_ms / 1000.0
+        if self.latency_dist == "constant" or mean <= 0:
+            return max(0.0, mean)
+        if self.latency_dist == "uniform":
+            return self.random.uniform(mean * (1 - self.latency_spread), mean * (1 + self.latency_spread))
+        # lognormal với median = latency_ms, spread là sigma
+        return mean * self.random.lognormvariate(0.0, self.latency_spread)
+
+settings = FakeGeminiSettings()
+
+ANALYSIS_RESPONSE = {
+    "Main Topics": ["Linear Algebra", "Matrix Multiplication"],
+    "Educational Value": 8,
+    "Relevance to Learning Community": 9,
+    "Content Appropriateness": "Appropriate",
+    "Key Concepts": ["Matrices", "Dot Product", "Linear Transformations"],
+    "Potential Learning Outcomes": ["Multiply two matrices", "Understand composition of linear maps"],
+    "Related Academic Disciplines": ["Mathematics", "Computer Science"],
+    "Content Classification": {"Type": "Tutorial", "Subject": "Mathematics", "Range Age Suitable": "16+ years"},
+    "Engagement Potential": 70,
+    "Credibility and Sources": 7,
+    "Improvement Suggestions": ["Add a worked example"],
+    "Related Topics": ["Vector Spaces", "Eigenvalues", "Numerical Linear Algebra"],
+    "Content Tags": ["math", "linear-algebra", "matrices"],
+    "Content Summary": "An introduction to matrix multiplication and its interpretation as composition of linear transformations.",
+    "Reasoning": "N/A"
+}
+
+CLARIFY_RESPONSE = """- **Main Idea**: Learning linear algebra for university exams.
+- **Related Topics**:
+- Linear algebra
+- Matrix multiplication
+- Vector spaces
+- Eigenvalues and eigenvectors
+- Numerical methods
+- Study materials for mathematics
+- Exam preparation techniques
+- Learning strategies for mathematics
+**The content focuses on core linear algebra concepts and how to prepare for exams on them.**"""
+
+# Clarify khi model được cấu hình response schema (JSON)
+CLARIFY_JSON_RESPONSE = {
+    "Main Idea": "Learning linear algebra for university exams.",
+    "Related Topics": [
+        "Linear algebra", "Matrix multiplication", "Vector spaces", "Eigenvalues and eigenvectors",
+        "Numerical methods", "Study materials for mathematics", "Exam preparation techniques",
+        "Learning strategies for mathematics"
+    ],
+    "Summary": "The content focuses on core linear algebra concepts and how to prepare for exams on them."
+}
+
+class _PromptFeedback:
+    def __init__(self, block_reason=None):
+        self.block_reason = block_reason
+
+class FakeResponse:
+    def __init__(self, text, block_reason=None):
+        self._text = text
+        self.prompt_feedback = _PromptFeedback(block_reason)
+
+    @property
+    def text(self):
+        if self.prompt_feedback.block_reason:
+            raise ValueError("Response was blocked")
+        return self._text
+
+class FakeGenerativeModel:
+    """Thay thế genai.GenerativeModel: không gọi mạng, trả kết quả cố định sau một độ trễ giả lập"""
+
+    def __init__(self, model_name="models/gemini-2.0-flash", **kwargs):
+        self.model_name = model_name
+        self.kwargs = kwargs
+
+    def _is_analysis(self, contents):
+        parts = contents if isinstance(contents, list) else [contents]
+        text = " ".join(str(p) for p in parts if isinstance(p, str))
+        text += str(self.kwargs.get("system_instruction", ""))
+        return "learning-focused social network" in text
+
+    async def generate_content_async(self, contents, **kwargs):
+        settings.calls += 1
+        await asyncio.sleep(settings.sample_latency())
+
+        roll = settings.random.random()
+        if roll < settings.rate_limit_rate:
+            settings.errors += 1
+            raise Exception("429 Resource has been exhausted (e.g. check quota).")
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            settings.errors += 1
+            raise Exception("500 An internal error has occurred.")
+        if roll < settings.rate_limit_rate + settings.error_rate + settings.block_rate:
+            return FakeResponse("", block_reason="SAFETY")
+
+        if self._is_analysis(contents):
+            return FakeResponse(json.dumps(ANALYSIS_RESPONSE))
+        if "generation_config" in self.kwargs:
+            return FakeResponse(json.dumps(CLARIFY_JSON_RESPONSE))
+        return FakeResponse(CLARIFY_RESPONSE)
+
+    def generate_content(self, contents, **kwargs):
+        return asyncio.get_event_loop().run_until_complete(self.generate_content_async(contents, **kwargs))
+
+def install():
+    """Patch google.generativeai để mọi request đi vào fake backend"""
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.configure = lambda *args, **kwargs: None
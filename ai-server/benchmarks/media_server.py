@@ -0,0 +1,50 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MediaServer:
+    """HTTP server local trả về media giả (bytes ngẫu nhiên) với kích thước cố định"""
+
+    CONTENT_TYPES = {"images": "image/jpeg", "videos": "video/mp4", "audios": "audio/mp4"}
+
+    def __init__(self, sizes_kb, host="127.0.0.1", port=0):
+        # Tạo sẵn payload để không tính chi phí sinh bytes vào benchmark
+        self.payloads = {kind: os.urandom(int(size_kb * 1024)) for kind, size_kb in sizes_kb.items()}
+        payloads = self.payloads
+        content_types = self.CONTENT_TYPES
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                kind = self.path.strip("/").split("/")[0]
+                payload = payloads.get(kind)
+                if payload is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_types[kind])
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, kind, index):
+        return f"{self.base_url}/{kind}/{index}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,259 @@
+"""Benchmark offline cho AI server.
+
+Chạy FastAPI app in-process với Gemini giả lập, MongoDB in-memory (mongomock) và
+một HTTP server local phục vụ media, rồi đo latency, throughput, embedding rows/s và RSS.
+
+    cd ai-server
+    pip install -r requirements.txt -r benchmarks/requirements.txt
+    python -m benchmarks.run_benchmark --workload mixed --requests 300 --concurrency 16
+
+ALBERT vẫn được load thật (cần có sẵn trong cache của HuggingFace hoặc có mạng lần đầu).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+
+WORDS = (
+    "matrix vector algebra calculus derivative integral history revolution empire literature poem "
+    "novel physics energy quantum chemistry molecule reaction biology cell protein programming python "
+    "algorithm database network security economics market inflation philosophy ethics logic exam "
+    "study notes lecture homework research experiment theory proof example question answer"
+).split()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark cho /analyze và /vectorize")
+    parser.add_argument("--workload", choices=["analyze", "vectorize", "feed", "mixed"], default="mixed")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    # Fake Gemini
+    parser.add_argument("--gemini-latency-ms", type=float, default=800.0)
+    parser.add_argument("--gemini-latency-dist", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--gemini-latency-spread", type=float, default=0.5)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-block-rate", type=float, default=0.0)
+    # Key manager: mặc định bỏ rate limit 4s/key để đo chính service
+    parser.add_argument("--min-delay", type=float, default=0.0)
+    # Nội dung bài viết
+    parser.add_argument("--post-words", type=int, default=120)
+    parser.add_argument("--images-per-post", type=int, default=1)
+    parser.add_argument("--image-kb", type=float, default=200.0)
+    parser.add_argument("--video-kb", type=float, default=2048.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--seed-posts", type=int, default=1000)
+    parser.add_argument("--json", dest="json_path", help="Ghi kết quả ra file JSON")
+    return parser.parse_args()
+
+def prepare_environment(args):
+    """Patch môi trường trước khi import app: key giả, Mongo in-memory, Gemini giả"""
+    for i in range(1, 35):
+        os.environ[f"API_KEY_{i}"] = f"fake-key-{i:02d}"
+    os.environ["MONGODB_URI"] = "mongodb://benchmark.invalid:27017"
+
+    import mongomock
+    import pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+
+    from benchmarks import fake_gemini
+    fake_gemini.settings.latency_ms = args.gemini_latency_ms
+    fake_gemini.settings.latency_dist = args.gemini_latency_dist
+    fake_gemini.settings.latency_spread = args.gemini_latency_spread
+    fake_gemini.settings.error_rate = args.gemini_error_rate
+    fake_gemini.settings.rate_limit_rate = args.gemini_rate_limit_rate
+    fake_gemini.settings.block_rate = args.gemini_block_rate
+    fake_gemini.settings.random.seed(args.seed)
+    fake_gemini.install()
+    return fake_gemini.settings
+
+class EmbeddingCounter:
+    """Bọc embed_func của embedding_batcher để đếm số dòng và thời gian forward"""
+
+    def __init__(self, embed_func):
+        self.embed_func = embed_func
+        self.rows = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def __call__(self, texts):
+        start = time.perf_counter()
+        result = self.embed_func(texts)
+        self.seconds += time.perf_counter() - start
+        self.rows += len(texts)
+        self.batches += 1
+        return result
+
+def read_rss_mb():
+    """RSS hiện tại và peak (MB)"""
+    current = peak = None
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return current, peak
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+class WorkloadBuilder:
+    def __init__(self, args, media_server, post_ids):
+        self.args = args
+        self.media_server = media_server
+        self.post_ids = post_ids
+        self.random = random.Random(args.seed)
+        self.previous_posts = []
+
+    def _text(self, words):
+        return " ".join(self.random.choice(WORDS) for _ in range(words))
+
+    def analyze(self, i):
+        if self.previous_posts and self.random.random() < self.args.duplicate_rate:
+            post = self.random.choice(self.previous_posts)
+        else:
+            post = self._text(self.args.post_words)
+            self.previous_posts.append(post)
+        images = [self.media_server.url("images", f"{i}-{n}") for n in range(self.args.images_per_post)]
+        value = {
+            "_id": self.post_ids[i % len(self.post_ids)],
+            "post": post,
+            "imgId": "", "imgVersion": "", "videoId": "", "videoVersion": "", "gifUrl": "",
+            "mediaItems": {"images": images, "videos": [], "audios": []}
+        }
+        return "/analyze", {"value": value}
+
+    def vectorize(self, i):
+        return "/vectorize", {"value": {"query": self._text(self.random.randint(2, 8))}}
+
+    def feed(self, i):
+        interests = " ".join(self.random.sample(WORDS, 3))
+        hobbies = " ".join(self.random.sample(WORDS, 2))
+        return "/vectorize", {"value": {"query": "", "userInterest": interests, "userHobbies": hobbies}}
+
+    def build(self, workload, i):
+        if workload == "mixed":
+            workload = self.random.choices(["analyze", "vectorize", "feed"], weights=[2, 3, 5])[0]
+        return getattr(self, workload)(i)
+
+async def run_requests(client, builder, workload, count, concurrency, records):
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < count:
+            i = next_index
+            next_index += 1
+            path, body = builder.build(workload, i)
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                status = response.status_code
+            except Exception:
+                status = -1
+            records.append((path, status, time.perf_counter() - start))
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+def summarize(records, elapsed):
+    summary = {}
+    for path in sorted({r[0] for r in records}) + ["all"]:
+        rows = [r for r in records if path == "all" or r[0] == path]
+        latencies = sorted(r[2] * 1000 for r in rows)
+        summary[path] = {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if r[1] != 200),
+            "rps": round(len(rows) / elapsed, 2) if elapsed > 0 else None,
+            "p50_ms": percentile(latencies, 50),
+            "p90_ms": percentile(latencies, 90),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": latencies[-1] if latencies else None,
+        }
+    return summary
+
+async def main(args):
+    gemini_settings = prepare_environment(args)
+
+    import httpx
+    from bson import ObjectId
+    from benchmarks.media_server import MediaServer
+    from app import app
+    from app.api_key_manager import api_key_manager
+    from app.embedding_batcher import embedding_batcher
+    from app.utils import collection
+
+    api_key_manager.min_delay = args.min_delay
+    counter = EmbeddingCounter(embedding_batcher.embed_func)
+    embedding_batcher.embed_func = counter
+
+    post_ids = [ObjectId() for _ in range(max(1, args.seed_posts))]
+    collection.insert_many([{"_id": post_id, "post": ""} for post_id in post_ids])
+    post_ids = [str(post_id) for post_id in post_ids]
+
+    media_server = MediaServer({"images": args.image_kb, "videos": args.video_kb, "audios": args.video_kb}).start()
+    builder = WorkloadBuilder(args, media_server, post_ids)
+    rss_before, _ = read_rss_mb()
+
+    try:
+        # lifespan_context chạy các startup / shutdown handler của app như khi chạy bằng uvicorn
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://ai-server", timeout=None) as client:
+                await run_requests(client, builder, args.workload, args.warmup, min(args.warmup, args.concurrency), [])
+
+                counter.rows = counter.batches = 0
+                counter.seconds = 0.0
+                gemini_settings.calls = gemini_settings.errors = 0
+
+                records = []
+                start = time.perf_counter()
+                await run_requests(client, builder, args.workload, args.requests, args.concurrency, records)
+                elapsed = time.perf_counter() - start
+    finally:
+        media_server.stop()
+
+    rss_after, rss_peak = read_rss_mb()
+    result = {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "endpoints": summarize(records, elapsed),
+        "embedding": {
+            "rows": counter.rows,
+            "batches": counter.batches,
+            "rows_per_s": round(counter.rows / elapsed, 2) if elapsed > 0 else None,
+            "forward_rows_per_s": round(counter.rows / counter.seconds, 2) if counter.seconds > 0 else None,
+            "avg_batch_size": round(counter.rows / counter.batches, 2) if counter.batches else None,
+        },
+        "gemini": {"calls": gemini_settings.calls, "errors": gemini_settings.errors},
+        "rss_mb": {"before": rss_before, "after": rss_after, "peak": rss_peak},
+    }
+
+    print(f"\nWorkload: {args.workload}, {args.requests} requests, concurrency {args.concurrency}, {elapsed:.2f}s")
+    print(f"{'endpoint':<12}{'req':>6}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for path, stats in result["endpoints"].items():
+        print(f"{path:<12}{stats['requests']:>6}{stats['errors']:>6}{stats['rps'] or 0:>9.2f}"
+              f"{stats['p50_ms'] or 0:>10.1f}{stats['p90_ms'] or 0:>10.1f}{stats['p99_ms'] or 0:>10.1f}{stats['max_ms'] or 0:>10.1f}")
+    print(f"Embedding: {counter.rows} rows in {counter.batches} batches, "
+          f"{result['embedding']['rows_per_s']} rows/s wall, {result['embedding']['forward_rows_per_s']} rows/s forward")
+    print(f"Gemini calls: {gemini_settings.calls} ({gemini_settings.errors} injected errors)")
+    print(f"RSS: before {rss_before} MB, after {rss_after} MB, peak {rss_peak} MB")
+
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(result, output, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))